@@ -0,0 +1,222 @@
+from compute_similarity import DamerauLevenshteinDistance
+import heapq
+import json
+import os
+
+
+class BKTree:
+    """
+    A metric index (Burkhard-Keller tree) over known addresses, keyed on the Damerau-Levenshtein distance.
+
+    Each node keeps its children by their distance to it. By the triangle inequality, the addresses
+    within a distance r of a query that is at distance d of a node can only be in the children at
+    distance d - r to d + r, so the rest of the tree is never compared.
+    """
+
+    def __init__(self, addresses=()):
+        """
+        Initializes the BKTree object with the given addresses.
+
+        Args:
+            addresses (iterable): The known addresses.
+        """
+        # The nodes are stored in flat lists, the root is the node 0
+        self.addresses = []
+        self.children = []
+
+        for address in addresses:
+            self.add(address)
+
+    def __len__(self):
+        return len(self.addresses)
+
+    def get_distance(self, first_address, second_address, bound=None):
+        """
+        Calculates and returns the Damerau-Levenshtein distance between two addresses.
+
+        Args:
+            first_address (str): The first address.
+            second_address (str): The second address.
+            bound (int, optional): The maximum distance of interest.
+
+        Returns:
+            int: The distance, or bound + 1 if the distance is larger than the bound.
+        """
+        return DamerauLevenshteinDistance(first_address, second_address).calculate_distance(bound)
+
+    def add(self, address):
+        """
+        Adds an address to the tree, if it is not already in it.
+
+        Args:
+            address (str): The address.
+
+        Returns:
+            bool: True if the address was added.
+        """
+        if not self.addresses:
+            self.addresses.append(address)
+            self.children.append({})
+            return True
+
+        node = 0
+        while True:
+            distance = self.get_distance(address, self.addresses[node])
+            if distance == 0:
+                return False
+
+            if distance not in self.children[node]:
+                self.children[node][distance] = len(self.addresses)
+                self.addresses.append(address)
+                self.children.append({})
+                return True
+
+            node = self.children[node][distance]
+
+    def within(self, address, max_distance):
+        """
+        Finds the known addresses within a maximum distance of the address.
+
+        Args:
+            address (str): The address.
+            max_distance (int): The maximum distance.
+
+        Returns:
+            list: A list of tuples (address, distance) sorted by distance.
+        """
+        matches = []
+        nodes = [0] if self.addresses else []
+
+        while nodes:
+            node = nodes.pop()
+            children = self.children[node]
+
+            # The exact distance is only needed up to the farthest child that can be visited
+            bound = max(children, default=0) + max_distance
+            distance = self.get_distance(address, self.addresses[node], bound)
+
+            if distance <= max_distance:
+                matches.append((self.addresses[node], distance))
+
+            for child_distance, child in children.items():
+                if abs(child_distance - distance) <= max_distance:
+                    nodes.append(child)
+
+        return sorted(matches, key=lambda match: (match[1], match[0]))
+
+    def nearest(self, address, k=1):
+        """
+        Finds the k known addresses nearest to the address.
+
+        Args:
+            address (str): The address.
+            k (int): The number of addresses.
+
+        Returns:
+            list: A list of at most k tuples (address, distance) sorted by distance.
+
+        Notes:
+            The search radius is the distance of the k-th best address found so far, and the nodes are
+            visited in order of their lower bound, so the radius shrinks as fast as possible.
+        """
+        if k <= 0 or not self.addresses:
+            return []
+
+        # Max-heap of the k best matches (negative distances) and min-heap of nodes by lower bound
+        best = []
+        nodes = [(0, 0)]
+
+        while nodes:
+            lower_bound, node = heapq.heappop(nodes)
+            radius = -best[0][0] if len(best) == k else None
+            if radius is not None and lower_bound > radius:
+                break
+
+            children = self.children[node]
+            bound = None if radius is None else max(children, default=0) + radius
+            distance = self.get_distance(address, self.addresses[node], bound)
+
+            if len(best) < k:
+                heapq.heappush(best, (-distance, self.addresses[node]))
+            elif distance < radius:
+                heapq.heapreplace(best, (-distance, self.addresses[node]))
+            radius = -best[0][0] if len(best) == k else None
+
+            for child_distance, child in children.items():
+                child_lower_bound = abs(child_distance - distance)
+                if radius is None or child_lower_bound <= radius:
+                    heapq.heappush(nodes, (max(child_lower_bound, lower_bound), child))
+
+        return sorted(((address, -distance) for distance, address in best), key=lambda match: (match[1], match[0]))
+
+    def save(self, file_path):
+        """
+        Saves the tree to a JSON file.
+
+        Args:
+            file_path (str): The path to the file.
+        """
+        tree = {
+            'addresses': self.addresses,
+            'children': [sorted(children.items()) for children in self.children],
+        }
+
+        # Write to a temporary file first, so a failed write does not corrupt the saved tree
+        temporary_path = file_path + '.tmp'
+        with open(temporary_path, 'w', encoding='utf-8') as file:
+            json.dump(tree, file, ensure_ascii=False)
+        os.replace(temporary_path, file_path)
+
+    @classmethod
+    def load(cls, file_path):
+        """
+        Loads a tree from a JSON file written by save.
+
+        Args:
+            file_path (str): The path to the file.
+
+        Returns:
+            BKTree: The tree.
+        """
+        with open(file_path, 'r', encoding='utf-8') as file:
+            tree = json.load(file)
+
+        index = cls()
+        index.addresses = tree['addresses']
+        index.children = [{distance: child for distance, child in children} for children in tree['children']]
+        return index
+
+
+if __name__ == "__main__":
+    # Test the index of known addresses
+    print("Test the index of known addresses")
+
+    known_addresses = ["Carrera 78A No 47-15", "CRA 70 # 26A - 33", "Cl. 30 # 43 - 17",
+                       "Calle 43A Numero 1 - 50", "Kra 57A Num 62 - 92", "Cra. 57a #62 92",
+                       "Cl. 43a #1 50", "Cra. 78A #47-15"]
+    index = BKTree(known_addresses)
+    print("Addresses in the index: {}".format(len(index)))
+    print("\n")
+
+    # Test the queries of addresses within a distance
+    print("Test the queries of addresses within a distance")
+
+    address = "Carrera 78A No 47 15"
+    print("Addresses within 3 of {} are {}".format(address, index.within(address, 3)))
+    print("\n")
+
+    # Test the queries of the nearest addresses
+    print("Test the queries of the nearest addresses")
+
+    address = "Cl 43A #1 50"
+    print("The 2 addresses nearest to {} are {}".format(address, index.nearest(address, 2)))
+    print("\n")
+
+    # Test the persistence of the index
+    print("Test the persistence of the index")
+
+    index.save('address_index.json')
+    loaded_index = BKTree.load('address_index.json')
+    loaded_index.add("Cl. 30 # 43 - 18")
+    print("Same results after loading: {}".format(loaded_index.within(address, 5) == index.within(address, 5)))
+    print("Addresses in the loaded index after adding one: {}".format(len(loaded_index)))
@@ -1,5 +1,8 @@
 import numpy as np
-from collections import defaultdict
+from collections import Counter, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+import itertools
+import os
 
 
 class DamerauLevenshteinDistance:
@@ -12,30 +15,97 @@ class DamerauLevenshteinDistance:
 
     """
 
-    def __init__(self, first_address, second_address):
+    engines = ('bit-parallel', 'matrix')
+
+    def __init__(self, first_address, second_address, engine='bit-parallel'):
         """
         Initializes the DamerauLevenshteinDistance object with the given addresses.
 
         Args:
             first_address (str): The first address.
             second_address (str): The second address.
+            engine (str): The algorithm used by calculate_distance. 'bit-parallel' (default) or
+                'matrix', the reference implementation.
+
+        Raises:
+            ValueError: If the engine is not supported.
         """
+        if engine not in self.engines:
+            raise ValueError(f'The engine ({engine}) is not supported. Supported engines are {self.engines}.')
 
         self.first_address = first_address
         self.second_address = second_address
+        self.engine = engine
 
         self.len_first_address = len(first_address)
         self.len_second_address = len(second_address)
         
         self.max_distance = self.len_first_address + self.len_second_address
         self.char_positions = defaultdict(int)
-        
-        # Create a distance matrix with additional rows and columns for boundary conditions
-        self.distance_matrix = [[0] * (self.len_second_address + 2) for _ in range(self.len_first_address + 2)]
 
-    def calculate_distance(self):
+        # The distance matrix is only allocated by the matrix engine
+        self.distance_matrix = None
+
+    def calculate_distance(self, bound=None):
+        """
+        Calculates and returns the Damerau-Levenshtein distance between the two addresses
+        using the engine selected at initialization.
+
+        Args:
+            bound (int, optional): The maximum distance of interest. If given, the computation stops
+                as soon as the distance is known to exceed it.
+
+        Returns:
+            int: The Damerau-Levenshtein distance, or bound + 1 if the distance is larger than the bound.
+        """
+        if bound is not None:
+            return self.calculate_bounded_distance(bound)
+
+        if self.engine == 'matrix':
+            return self.calculate_distance_matrix()
+        return self.calculate_distance_bit_parallel()
+
+    def calculate_bounded_distance(self, bound):
+        """
+        Calculates and returns the Damerau-Levenshtein distance between the two addresses if it is
+        not larger than the bound.
+
+        Args:
+            bound (int): The maximum distance of interest.
+
+        Returns:
+            int: The Damerau-Levenshtein distance, or bound + 1 if the distance is larger than the bound.
+
+        Notes:
+            The cheapest checks go first: the difference of lengths and the bag distance are lower
+            bounds of the distance, so they reject most of the pairs without filling any matrix.
+        """
+        exceeded = bound + 1
+
+        if abs(self.len_first_address - self.len_second_address) > bound:
+            return exceeded
+
+        bag_distance = self.calculate_bag_distance()
+        if bag_distance > bound:
+            return exceeded
+
+        if self.engine == 'bit-parallel':
+            # Each transposition with edits between its characters costs at least 2 and saves at
+            # most 1, so the Damerau-Levenshtein distance is at least 2/3 of this distance
+            transposition_bound = bound * 3 // 2
+            distance = self.calculate_transposition_distance(transposition_bound)
+            if distance > transposition_bound:
+                return exceeded
+
+            if distance <= 2 or distance == bag_distance:
+                return min(distance, exceeded)
+
+        return self.calculate_distance_banded(bound)
+
+    def calculate_distance_matrix(self):
         """
         Calculates and returns the Damerau-Levenshtein distance between the two addresses.
+        This is the reference implementation, it runs in O(n*m) time and memory.
 
         Returns:
             int: The Damerau-Levenshtein distance.
@@ -46,6 +116,10 @@ class DamerauLevenshteinDistance:
             second address up to position j.
         """
 
+        # Create a distance matrix with additional rows and columns for boundary conditions
+        self.distance_matrix = [[0] * (self.len_second_address + 2) for _ in range(self.len_first_address + 2)]
+        self.char_positions = defaultdict(int)
+
         self.distance_matrix[0][0] = self.max_distance
 
         # Initialize the first row and column of the distance matrix
@@ -62,6 +136,8 @@ class DamerauLevenshteinDistance:
             previous_matching_j = 0
             for j in range(1, self.len_second_address + 1):
                 previous_matching_i = self.char_positions[self.second_address[j - 1]]
+                # The transposition looks at the last match before the current column
+                last_matching_j = previous_matching_j
 
                 # Calculate the cost of the current operation (insertion, deletion, substitution, or transposition)
                 cost = 1
@@ -73,8 +149,8 @@ class DamerauLevenshteinDistance:
                 insertion = self.distance_matrix[i + 1][j] + 1
                 deletion = self.distance_matrix[i][j + 1] + 1
                 substitution = self.distance_matrix[i][j] + cost
-                transposition = self.distance_matrix[previous_matching_i][previous_matching_j] + (
-                            i - previous_matching_i - 1) + 1 + (j - previous_matching_j - 1)
+                transposition = self.distance_matrix[previous_matching_i][last_matching_j] + (
+                            i - previous_matching_i - 1) + 1 + (j - last_matching_j - 1)
 
                 # Choose the minimum cost among all possible operations
                 self.distance_matrix[i + 1][j + 1] = min(insertion, deletion, substitution, transposition)
@@ -85,35 +161,626 @@ class DamerauLevenshteinDistance:
         # The final distance is the value in the bottom-right corner of the distance matrix
         return self.distance_matrix[self.len_first_address + 1][self.len_second_address + 1]
 
+    def calculate_distance_banded(self, bound):
+        """
+        Calculates and returns the Damerau-Levenshtein distance between the two addresses if it is
+        not larger than the bound, filling only a diagonal band of the distance matrix.
+
+        Args:
+            bound (int): The maximum distance of interest.
+
+        Returns:
+            int: The Damerau-Levenshtein distance, or bound + 1 if the distance is larger than the bound.
+
+        Notes:
+            The entry (i, j) is at least |i - j|, so the entries farther than the bound from the diagonal
+            are left at bound + 1. The minimum of a row never decreases in the next rows, so the
+            computation stops at the first row where every entry is larger than the bound.
+        """
+        exceeded = bound + 1
+
+        if abs(self.len_first_address - self.len_second_address) > bound:
+            return exceeded
+
+        self.distance_matrix = [[exceeded] * (self.len_second_address + 2) for _ in range(self.len_first_address + 2)]
+        self.char_positions = defaultdict(int)
+
+        self.distance_matrix[0][0] = self.max_distance
+
+        # Initialize the first row and column of the distance matrix
+        for i in range(self.len_first_address + 1):
+            self.distance_matrix[i + 1][0] = self.max_distance
+            self.distance_matrix[i + 1][1] = i
+
+        for i in range(self.len_second_address + 1):
+            self.distance_matrix[0][i + 1] = self.max_distance
+            self.distance_matrix[1][i + 1] = i
+
+        # Fill in the band of the distance matrix
+        for i in range(1, self.len_first_address + 1):
+            previous_matching_j = 0
+            first_j = max(1, i - bound)
+            last_j = min(self.len_second_address, i + bound)
+            row_minimum = i  # The first column holds the deletion of the whole prefix
+
+            for j in range(first_j, last_j + 1):
+                previous_matching_i = self.char_positions[self.second_address[j - 1]]
+                last_matching_j = previous_matching_j
+
+                cost = 1
+                if self.first_address[i - 1] == self.second_address[j - 1]:
+                    cost = 0
+                    previous_matching_j = j
+
+                insertion = self.distance_matrix[i + 1][j] + 1
+                deletion = self.distance_matrix[i][j + 1] + 1
+                substitution = self.distance_matrix[i][j] + cost
+                transposition = self.distance_matrix[previous_matching_i][last_matching_j] + (
+                            i - previous_matching_i - 1) + 1 + (j - last_matching_j - 1)
+
+                distance = min(insertion, deletion, substitution, transposition)
+                self.distance_matrix[i + 1][j + 1] = distance
+                row_minimum = min(row_minimum, distance)
+
+            self.char_positions[self.first_address[i - 1]] = i
+
+            # No entry of this row is within the bound, so neither is the final distance
+            if row_minimum > bound:
+                return exceeded
+
+        return min(self.distance_matrix[self.len_first_address + 1][self.len_second_address + 1], exceeded)
+
+    def calculate_distance_bit_parallel(self):
+        """
+        Calculates and returns the Damerau-Levenshtein distance between the two addresses
+        using bit-vectors.
+
+        Returns:
+            int: The Damerau-Levenshtein distance.
+
+        Notes:
+            The bit-vector distance allows transpositions of adjacent characters only, so it can be
+            larger than the Damerau-Levenshtein distance when a transposed pair needs another edit
+            between its characters (e.g. "ca" and "abc"). That can only happen for distances above 2
+            and when the distance is above the bag distance, so only those pairs are sent to the matrix.
+        """
+        distance = self.calculate_transposition_distance()
+
+        if distance <= 2 or distance == self.calculate_bag_distance():
+            return distance
+
+        return self.calculate_distance_matrix()
+
+    def calculate_transposition_distance(self, bound=None):
+        """
+        Calculates and returns the edit distance between the two addresses when only adjacent
+        characters can be transposed (optimal string alignment), with Hyyro's bit-vector algorithm.
+
+        Args:
+            bound (int, optional): The maximum distance of interest. If given, the computation stops
+                as soon as the distance is known to exceed it.
+
+        Returns:
+            int: The optimal string alignment distance, or bound + 1 if the distance is larger than the bound.
+
+        Notes:
+            Each column of the distance matrix is encoded as bit-vectors of vertical differences
+            (+1 or -1) over the first address, so a whole column is computed with a few integer
+            operations. Python integers have arbitrary precision, so there is no length limit.
+        """
+        if self.len_first_address == 0:
+            return self.len_second_address
+
+        all_ones = (1 << self.len_first_address) - 1
+        last_bit = 1 << (self.len_first_address - 1)
+        char_masks = self.get_char_masks(self.first_address)
+
+        column = self.get_first_column(self.len_first_address)
+        remaining_chars = self.len_second_address
+
+        for char in self.second_address:
+            column = self.get_next_column(column, char_masks.get(char, 0), all_ones, last_bit)
+
+            # Each remaining character changes the distance by at most one
+            remaining_chars -= 1
+            if bound is not None and column[4] - remaining_chars > bound:
+                return bound + 1
+
+        return column[4]
+
+    @staticmethod
+    def get_char_masks(address):
+        """
+        Returns the bit mask of the positions of each character in the address.
+
+        Args:
+            address (str): The address.
+
+        Returns:
+            dict: A dictionary with the bit mask of each character.
+        """
+        char_masks = {}
+        for i, char in enumerate(address):
+            char_masks[char] = char_masks.get(char, 0) | (1 << i)
+        return char_masks
+
+    @staticmethod
+    def get_first_column(length):
+        """
+        Returns the bit-vector encoding of the first column of the distance matrix.
+
+        Args:
+            length (int): The length of the address along the column.
+
+        Returns:
+            tuple: The positive and negative vertical differences, the zero diagonal differences,
+                the character mask of the previous column and the value of the last row.
+        """
+        return (1 << length) - 1, 0, 0, 0, length
+
+    @staticmethod
+    def get_next_column(column, char_mask, all_ones, last_bit):
+        """
+        Computes the next column of the distance matrix in its bit-vector encoding.
+
+        Args:
+            column (tuple): The current column, as returned by get_first_column.
+            char_mask (int): The bit mask of the positions of the next character.
+            all_ones (int): The bit mask of all the rows.
+            last_bit (int): The bit mask of the last row.
+
+        Returns:
+            tuple: The next column.
+        """
+        positive_vertical, negative_vertical, zero_diagonal, previous_char_mask, distance = column
+
+        # Positions where swapping the current and the previous characters gives a match
+        transposition = ((~zero_diagonal & char_mask) << 1) & previous_char_mask
+
+        zero_diagonal = ((((char_mask & positive_vertical) + positive_vertical) ^ positive_vertical)
+                         | char_mask | negative_vertical | transposition) & all_ones
+        positive_horizontal = (negative_vertical | ~(zero_diagonal | positive_vertical)) & all_ones
+        negative_horizontal = zero_diagonal & positive_vertical
+
+        # Track the value of the last row
+        if positive_horizontal & last_bit:
+            distance += 1
+        elif negative_horizontal & last_bit:
+            distance -= 1
+
+        positive_horizontal = ((positive_horizontal << 1) | 1) & all_ones
+        negative_horizontal = (negative_horizontal << 1) & all_ones
+        positive_vertical = (negative_horizontal | ~(zero_diagonal | positive_horizontal)) & all_ones
+        negative_vertical = positive_horizontal & zero_diagonal
+
+        return positive_vertical, negative_vertical, zero_diagonal, char_mask, distance
+
+    def calculate_bag_distance(self):
+        """
+        Calculates and returns the bag distance between the two addresses, a lower bound of the
+        Damerau-Levenshtein distance that ignores the order of the characters.
+
+        Returns:
+            int: The bag distance.
+        """
+        first_chars = Counter(self.first_address)
+        second_chars = Counter(self.second_address)
+
+        return max(sum((first_chars - second_chars).values()), sum((second_chars - first_chars).values()))
+
+
+class CandidateTrie:
+    """
+    A prefix tree of candidate addresses used to compute the distance from one address to many
+    candidates at once.
+
+    The columns of the distance matrix only depend on the prefix of the candidate read so far, so
+    the candidates that share a prefix (e.g. "Cra 70 Nro 26A ..." and "Cra 70 Numero ...") share
+    the computation of those columns.
+
+    Each node is a dictionary from the next character to the child node. The None key holds the
+    candidate that ends at the node, and the empty string (never a character) holds the position
+    of the last candidate inserted under the node.
+    """
+
+    # Key of the position of the last insertion under a node
+    position_key = ''
+
+    def __init__(self, candidates=()):
+        """
+        Initializes the CandidateTrie object with the given candidates.
+
+        Args:
+            candidates (iterable): The candidate addresses.
+        """
+        # An empty tree has no insertion, so it is skipped for any position
+        self.root = {self.position_key: -1}
+        self.candidates = []
+        self.size = 0
+
+        # Number of insertions and position of the last insertion of each candidate, to walk only
+        # the candidates inserted after a position
+        self.inserted = 0
+        self.candidate_positions = {}
+
+        for candidate in candidates:
+            self.insert(candidate)
+
+    def insert(self, candidate):
+        """
+        Inserts a candidate address in the prefix tree.
+
+        Args:
+            candidate (str): The candidate address.
+        """
+        node = self.root
+        node[self.position_key] = self.inserted
+        for char in candidate:
+            if char not in node:
+                node[char] = {}
+                self.size += 1
+            node = node[char]
+            node[self.position_key] = self.inserted
+        self.candidate_positions[candidate] = self.inserted
+        self.inserted += 1
+
+        # The None key marks the end of a candidate
+        if None not in node:
+            node[None] = candidate
+            self.candidates.append(candidate)
+
+    def get_distances(self, address, min_position=0):
+        """
+        Calculates and returns the Damerau-Levenshtein distance between the address and each candidate.
+
+        Args:
+            address (str): The address.
+            min_position (int): Only the candidates inserted at this position or later (counting every
+                insertion, also of repeated candidates) are computed, the subtrees of the earlier ones
+                are skipped.
+
+        Returns:
+            dict: A dictionary with the distance to each candidate, in insertion order.
+
+        Notes:
+            The tree is walked depth-first carrying the bit-vector column of each node and the bag
+            distance of its prefix. As in DamerauLevenshteinDistance, the candidates whose bit-vector
+            distance is not provably exact are computed with the matrix, in a tree of their own.
+        """
+        if min_position > 0:
+            candidates = [candidate for candidate in self.candidates
+                          if self.candidate_positions[candidate] >= min_position]
+        else:
+            candidates = self.candidates
+
+        if not address:
+            return {candidate: len(candidate) for candidate in candidates}
+
+        all_ones = (1 << len(address)) - 1
+        last_bit = 1 << (len(address) - 1)
+        char_masks = DamerauLevenshteinDistance.get_char_masks(address)
+
+        # Characters of the address not yet matched by the characters of the prefix
+        unmatched_chars = Counter(address)
+
+        distances = {}
+        unresolved = []
+        first_column = DamerauLevenshteinDistance.get_first_column(len(address))
+
+        # Each entry is a node, the character leading to it and the state of its parent
+        stack = [(self.root, None, first_column, 0, 0)] if self.root[self.position_key] >= min_position else []
+
+        while stack:
+            node, char, column, matched_chars, extra_chars = stack.pop()
+
+            # A None node restores the unmatched character when leaving a subtree
+            if node is None:
+                unmatched_chars[char] += 1
+                continue
+
+            if char is not None:
+                column = DamerauLevenshteinDistance.get_next_column(
+                    column, char_masks.get(char, 0), all_ones, last_bit)
+
+                if unmatched_chars[char] > 0:
+                    unmatched_chars[char] -= 1
+                    matched_chars += 1
+                    stack.append((None, char, None, 0, 0))
+                else:
+                    extra_chars += 1
+
+            for child_char, child in node.items():
+                if child_char is None:
+                    # A prefix shared with a later candidate can end an earlier one
+                    if self.candidate_positions[child] < min_position:
+                        continue
+
+                    distance = column[4]
+                    bag_distance = max(len(address) - matched_chars, extra_chars)
+                    if distance > 2 and distance != bag_distance:
+                        unresolved.append(child)
+                    distances[child] = distance
+                elif child_char != self.position_key and child[self.position_key] >= min_position:
+                    stack.append((child, child_char, column, matched_chars, extra_chars))
+
+        if unresolved:
+            distances.update(CandidateTrie(unresolved).get_matrix_distances(address))
+
+        return {candidate: distances[candidate] for candidate in candidates}
+
+    def get_matrix_distances(self, address):
+        """
+        Calculates and returns the Damerau-Levenshtein distance between the address and each candidate
+        with the matrix recurrence of DamerauLevenshteinDistance.calculate_distance_matrix.
+
+        Args:
+            address (str): The address.
+
+        Returns:
+            dict: A dictionary with the distance to each candidate, in insertion order.
+
+        Notes:
+            Each node of the tree is a row of the distance matrix (the candidates are along the rows and
+            the address along the columns), so the rows of a shared prefix are computed once. The rows
+            of the current path are kept because transpositions read rows further up.
+        """
+        len_address = len(address)
+        max_distance = len_address + max((len(candidate) for candidate in self.candidates), default=0)
+
+        rows = [[max_distance] * (len_address + 2), [max_distance] + list(range(len_address + 1))]
+        char_positions = defaultdict(int)
+
+        distances = {}
+        if None in self.root:
+            distances[self.root[None]] = len_address
+
+        # Each entry is a node, the character leading to it and its depth
+        stack = [(child, char, 1) for char, child in self.root.items() if char]
+
+        while stack:
+            node, char, i = stack.pop()
+
+            # A None node restores the last position of a character when leaving a subtree
+            if node is None:
+                char_positions[char] = i
+                continue
+
+            # Drop the rows of the previous subtree and compute the row of this node
+            del rows[i + 1:]
+            row = [max_distance, i] + [0] * len_address
+            rows.append(row)
+
+            previous_matching_j = 0
+            for j in range(1, len_address + 1):
+                previous_matching_i = char_positions[address[j - 1]]
+                last_matching_j = previous_matching_j
+
+                cost = 1
+                if char == address[j - 1]:
+                    cost = 0
+                    previous_matching_j = j
+
+                insertion = row[j] + 1
+                deletion = rows[i][j + 1] + 1
+                substitution = rows[i][j] + cost
+                transposition = rows[previous_matching_i][last_matching_j] + (
+                            i - previous_matching_i - 1) + 1 + (j - last_matching_j - 1)
+
+                row[j + 1] = min(insertion, deletion, substitution, transposition)
+
+            if None in node:
+                distances[node[None]] = row[len_address + 1]
+
+            stack.append((None, char, char_positions[char]))
+            char_positions[char] = i
+            stack.extend((child, child_char, i + 1) for child_char, child in node.items() if child_char)
+
+        return {candidate: distances[candidate] for candidate in self.candidates}
+
+
+class QGramIndex:
+    """
+    An inverted index of the q-grams (substrings of length q) of candidate addresses, used to discard
+    the candidates that cannot reach a similarity threshold before computing any distance.
+
+    Each edit operation destroys at most q + 1 q-grams (a transposition touches two positions), so two
+    addresses at distance k share at least max(g1, g2) - k * (q + 1) q-grams, where g1 and g2 are their
+    numbers of q-grams. The candidates that share fewer are rejected (count filter).
+    """
+
+    def __init__(self, candidates=(), q=2):
+        """
+        Initializes the QGramIndex object with the given candidates.
+
+        Args:
+            candidates (iterable): The candidate addresses.
+            q (int): The length of the q-grams.
+        """
+        self.q = q
+        self.candidates = []
+        self.qgram_counts = []
+        self.postings = defaultdict(list)
+        self.positions = {}
+
+        for candidate in candidates:
+            self.add(candidate)
+
+    def get_qgrams(self, address):
+        """
+        Returns the q-grams of an address.
+
+        Args:
+            address (str): The address.
+
+        Returns:
+            Counter: The number of occurrences of each q-gram.
+        """
+        return Counter(address[i:i + self.q] for i in range(len(address) - self.q + 1))
+
+    def add(self, candidate):
+        """
+        Adds a candidate address to the index, if it is not already in it.
+
+        Args:
+            candidate (str): The candidate address.
+        """
+        if candidate in self.positions:
+            return
+
+        position = len(self.candidates)
+        self.positions[candidate] = position
+        self.candidates.append(candidate)
+
+        qgrams = self.get_qgrams(candidate)
+        self.qgram_counts.append(sum(qgrams.values()))
+        for qgram, count in qgrams.items():
+            self.postings[qgram].append((position, count))
+
+    def get_shared_qgrams(self, address):
+        """
+        Counts the q-grams that the address shares with each candidate.
+
+        Args:
+            address (str): The address.
+
+        Returns:
+            list: The number of shared q-grams with each candidate, in insertion order.
+        """
+        shared_qgrams = [0] * len(self.candidates)
+        for qgram, count in self.get_qgrams(address).items():
+            for position, candidate_count in self.postings.get(qgram, ()):
+                shared_qgrams[position] += min(count, candidate_count)
+        return shared_qgrams
+
+    def get_rejections(self, address, threshold):
+        """
+        Returns the candidates that cannot reach the similarity threshold with the address.
+
+        Args:
+            address (str): The address.
+            threshold (float): The threshold for the similarity score.
+
+        Returns:
+            dict: The stage that rejects each rejected candidate, 'length' or 'q-gram'.
+        """
+        address_qgram_count = max(len(address) - self.q + 1, 0)
+        shared_qgrams = self.get_shared_qgrams(address)
+
+        rejections = {}
+        for position, candidate in enumerate(self.candidates):
+            max_distance = AddressSimilarity.get_max_distance(address, candidate, threshold)
+
+            if abs(len(address) - len(candidate)) > max_distance:
+                rejections[candidate] = 'length'
+            elif shared_qgrams[position] < (max(address_qgram_count, self.qgram_counts[position])
+                                            - max_distance * (self.q + 1)):
+                rejections[candidate] = 'q-gram'
+
+        return rejections
+
+    def filter_candidates(self, address, threshold):
+        """
+        Returns the candidates that can reach the similarity threshold with the address.
+
+        Args:
+            address (str): The address.
+            threshold (float): The threshold for the similarity score.
+
+        Returns:
+            list: The candidates that pass the length and the q-gram count filters, in insertion order.
+        """
+        rejections = self.get_rejections(address, threshold)
+        return [candidate for candidate in self.candidates if candidate not in rejections]
+
 
 class AddressSimilarity:
     """
     Calculates the similarity between an address and a list of homonyms addresses.
     """
-    def __init__(self, original_address, homonyms_address):
+    def __init__(self, original_address, homonyms_address, prefilter=None, cache=None):
         """
         Initializes the AddressSimilarity object with the given addresses.
 
         Args:
             original_address (str): The original address.
-            homonyms_address (list): The list of homonyms addresses.
+            homonyms_address (iterable): The homonyms addresses, a list or a generator.
+            prefilter (QGramIndex, optional): An index of the homonyms addresses. If given, the homonyms
+                that cannot reach the threshold of get_all_scores are discarded before computing any distance.
+                The homonyms missing from the index are not filtered, they are scored with the exact distance.
+            cache (SimilarityCache, optional): A cache of similarity scores. If given, the scores are looked up
+                in it before computing the distance.
             
         """
         self.original_address = original_address
         self.homonyms_address = homonyms_address
+        self.prefilter = prefilter
+        self.cache = cache
 
-    def get_similarity_score(self, first_address, second_address):
+        # Number of homonyms removed by each stage in the last call to get_all_scores with a threshold,
+        # and number of homonyms missing from the prefilter index
+        self.stage_counts = {}
+
+    @staticmethod
+    def get_max_distance(first_address, second_address, threshold):
+        """
+        Calculates and returns the largest distance between the two addresses that still gives a
+        similarity score above the threshold.
+
+        Args:
+            first_address (str): The first address.
+            second_address (str): The second address.
+            threshold (float): The threshold for the similarity score.
+
+        Returns:
+            int: The largest distance allowed, -1 if no distance reaches the threshold.
+        """
+        max_length_address = max(len(first_address), len(second_address))
+
+        # Start from the estimate and correct it with the same expression used for the score
+        max_distance = min(max(int((1 - threshold) * max_length_address), 0), max_length_address)
+        while max_distance < max_length_address and 1 - (max_distance + 1) / max_length_address >= threshold:
+            max_distance += 1
+        while max_distance >= 0 and 1 - max_distance / max_length_address < threshold:
+            max_distance -= 1
+
+        return max_distance
+
+    def get_similarity_score(self, first_address, second_address, threshold=None):
         """
         Calculates and returns the similarity score between the two addresses.
 
         Args:
             first_address (str): The first address.
             second_address (str): The second address.
+            threshold (float, optional): The threshold for the similarity score. If given, the distance
+                is only computed up to the largest distance that reaches the threshold.
 
         Returns:
-            float: The similarity score.
+            float: The similarity score, or None if the score is below the threshold.
         """
-        distance = DamerauLevenshteinDistance(first_address, second_address).calculate_distance()
+        if self.cache is not None:
+            cached = self.cache.get(first_address, second_address, threshold)
+            if cached is not None:
+                score, exact = cached
+                if not exact or (threshold is not None and score < threshold):
+                    return None
+                return score
+
+        if threshold is not None and (first_address or second_address):
+            max_distance = self.get_max_distance(first_address, second_address, threshold)
+            distance = None
+            if max_distance >= 0:
+                distance = DamerauLevenshteinDistance(first_address, second_address).calculate_distance(max_distance)
+
+            if distance is None or distance > max_distance:
+                # The distance is at least max_distance + 1, which bounds the score below the threshold
+                if self.cache is not None:
+                    max_length_address = max(len(first_address), len(second_address))
+                    self.cache.put(first_address, second_address,
+                                   1 - (max_distance + 1) / max_length_address, exact=False)
+                return None
+        else:
+            distance = DamerauLevenshteinDistance(first_address, second_address).calculate_distance()
 
         length_first_address = len(first_address)
         length_second_address = len(second_address)
@@ -121,19 +788,79 @@ class AddressSimilarity:
         max_length_address = np.max([length_first_address, length_second_address])
         
         score = 1 - distance / max_length_address
+
+        if self.cache is not None:
+            self.cache.put(first_address, second_address, score)
+
         return score
 
-    def get_all_scores(self):
+    def get_all_scores(self, threshold=None):
         """
         Calculates and returns the similarity score between the original address and each homonym address.
+        The homonyms addresses can be any iterable, e.g. HomonymsGenerator.iter_homonyms.
+
+        Args:
+            threshold (float, optional): The threshold for the similarity score. If given, only the homonym
+                addresses with a score above the threshold are returned, and the rest are rejected
+                without computing their full distance. The number of homonyms removed by each stage
+                is kept in stage_counts.
 
         Returns:
             dict: A dictionary with the similarity score for each homonym address.
         """
+        # The homonyms are read once, so they can come from a generator
+        rejections = {}
+        if threshold is not None:
+            self.stage_counts = {'candidates': 0, 'unindexed': 0, 'length': 0, 'q-gram': 0, 'distance': 0,
+                                 'accepted': 0}
+            if self.prefilter is not None:
+                rejections = self.prefilter.get_rejections(self.original_address, threshold)
+
         dict_scores = {}
         for address in self.homonyms_address:
-            score = self.get_similarity_score(self.original_address, address)
-            dict_scores[address] = score
+            if threshold is None:
+                dict_scores[address] = self.get_similarity_score(self.original_address, address)
+                continue
+
+            self.stage_counts['candidates'] += 1
+            if address in rejections:
+                self.stage_counts[rejections[address]] += 1
+                continue
+
+            # The index only rejects its own candidates, the rest go straight to the distance
+            if self.prefilter is not None and address not in self.prefilter.positions:
+                self.stage_counts['unindexed'] += 1
+
+            score = self.get_similarity_score(self.original_address, address, threshold)
+            if score is None:
+                self.stage_counts['distance'] += 1
+            else:
+                self.stage_counts['accepted'] += 1
+                dict_scores[address] = score
+
+        return dict_scores
+
+    def get_batch_scores(self, threshold=None):
+        """
+        Calculates and returns the similarity score between the original address and each homonym address,
+        sharing the computation between homonyms with a common prefix.
+
+        Args:
+            threshold (float, optional): The threshold for the similarity score. If given, only the homonym
+                addresses with a score above the threshold are returned.
+
+        Returns:
+            dict: A dictionary with the similarity score for each homonym address, the same as get_all_scores.
+        """
+        trie = CandidateTrie(self.homonyms_address)
+        distances = trie.get_distances(self.original_address)
+
+        dict_scores = {}
+        for address, distance in distances.items():
+            max_length_address = np.max([len(self.original_address), len(address)])
+            score = 1 - distance / max_length_address
+            if threshold is None or score >= threshold:
+                dict_scores[address] = score
         return dict_scores
 
     def filter_best_scores(self, dict_scores, threshold):
@@ -158,7 +885,351 @@ class AddressSimilarity:
 
     
 
+
+class LatticeSimilarity:
+    """
+    Calculates the similarity between an address and the homonyms of a replacement lattice
+    (see HomonymsGenerator.get_lattice) without expanding the lattice.
+
+    The homonyms are the tokens of the lattice joined by spaces, with one option per token. The
+    distance matrix is computed column by column over the characters of the homonyms, and the
+    homonyms that reach the end of a token with the same length and the same last character are
+    merged into a single column (the minimum of their columns), so the work grows with the sum
+    of the options and not with their product. Only get_best_distances and get_best_score work
+    on the lattice, get_path_scores expands it.
+
+    Merging the columns needs the distance with transpositions of adjacent characters only (see
+    get_best_distances), so the homonym chosen on the lattice is approximate: when a transposition
+    needs another edit between its characters, it may not be the homonym with the best
+    Damerau-Levenshtein score. It is exact whenever both distances agree, which is the usual case
+    for addresses.
+    """
+
+    def __init__(self, original_address, lattice):
+        """
+        Initializes the LatticeSimilarity object with the given address and lattice.
+
+        Args:
+            original_address (str): The original address.
+            lattice (list): A list of tuples (token, options) as returned by HomonymsGenerator.get_lattice.
+        """
+        self.original_address = original_address
+        self.lattice = lattice
+
+    def get_next_column(self, previous_column, column, previous_char, char):
+        """
+        Computes the next column of the distance matrix, keeping for each entry the homonym tokens
+        chosen so far by the homonym that reaches it.
+
+        Args:
+            previous_column (tuple): The values and paths of the column before the current one, or None.
+            column (tuple): The values and paths of the current column.
+            previous_char (str): The character of the current column, or None.
+            char (str): The character of the next column.
+
+        Returns:
+            tuple: The values and paths of the next column.
+        """
+        address = self.original_address
+        values, paths = column
+        next_values = [values[0] + 1]
+        next_paths = [paths[0]]
+
+        for i in range(1, len(address) + 1):
+            # Deletion, insertion and substitution (or match)
+            value, path = values[i] + 1, paths[i]
+            if next_values[i - 1] + 1 < value:
+                value, path = next_values[i - 1] + 1, next_paths[i - 1]
+            if values[i - 1] + (address[i - 1] != char) < value:
+                value, path = values[i - 1] + (address[i - 1] != char), paths[i - 1]
+
+            # Transposition of two adjacent characters
+            if (i > 1 and previous_column is not None and address[i - 1] == previous_char
+                    and address[i - 2] == char and previous_column[0][i - 2] + 1 < value):
+                value, path = previous_column[0][i - 2] + 1, previous_column[1][i - 2]
+
+            next_values.append(value)
+            next_paths.append(path)
+
+        return next_values, next_paths
+
+    def get_best_distances(self):
+        """
+        Calculates the smallest distance between the original address and the homonyms of the lattice,
+        for each length of the homonyms.
+
+        Returns:
+            dict: A dictionary with a tuple (homonym, distance) for each length. The original tokens are
+                not a homonym, as in HomonymsGenerator.generate_homonyms.
+
+        Notes:
+            Merging homonyms needs a recurrence where each column only depends on the two previous
+            ones, so the distance allows transpositions of adjacent characters only. It is the
+            Damerau-Levenshtein distance unless a transposed pair needs another edit between its
+            characters.
+        """
+        length = len(self.original_address)
+        first_column = (list(range(length + 1)), [()] * (length + 1))
+
+        # States by (length, differs from the original tokens, last character)
+        states = {(0, False, None): (None, first_column)}
+
+        for position, (token, options) in enumerate(self.lattice):
+            next_states = {}
+            for (homonym_length, differs, last_char), (previous_column, column) in states.items():
+
+                # The space between tokens is shared by all the options
+                if position > 0:
+                    previous_column, column = column, self.get_next_column(previous_column, column, last_char, ' ')
+                    homonym_length, last_char = homonym_length + 1, ' '
+
+                for option in options:
+                    option_previous_column, option_column, option_char = previous_column, column, last_char
+                    for char in option:
+                        option_previous_column, option_column = option_column, self.get_next_column(
+                            option_previous_column, option_column, option_char, char)
+                        option_char = char
+
+                    # Record the option in the paths of both columns, the next token can read both
+                    key = (homonym_length + len(option), differs or option != token, option_char)
+                    columns = tuple(None if option_column is None else
+                                    (option_column[0], [path + (option,) for path in option_column[1]])
+                                    for option_column in (option_previous_column, option_column))
+
+                    if key in next_states:
+                        columns = tuple(map(self.merge_columns, next_states[key], columns))
+                    next_states[key] = columns
+
+            states = next_states
+
+        best_distances = {}
+        for (homonym_length, differs, _), (_, (values, paths)) in states.items():
+            if differs and (homonym_length not in best_distances or values[-1] < best_distances[homonym_length][1]):
+                best_distances[homonym_length] = (' '.join(paths[-1]), values[-1])
+
+        return best_distances
+
+    @staticmethod
+    def merge_columns(first_column, second_column):
+        """
+        Merges two columns keeping the smallest value of each entry and its path.
+
+        Args:
+            first_column (tuple): The values and paths of the first column, or None.
+            second_column (tuple): The values and paths of the second column, or None.
+
+        Returns:
+            tuple: The merged column.
+        """
+        if first_column is None or second_column is None:
+            return first_column or second_column
+
+        values, paths = [], []
+        for first_value, first_path, second_value, second_path in zip(*first_column, *second_column):
+            if second_value < first_value:
+                values.append(second_value)
+                paths.append(second_path)
+            else:
+                values.append(first_value)
+                paths.append(first_path)
+        return values, paths
+
+    def get_best_score(self):
+        """
+        Calculates and returns a homonym of the lattice close to the original address, usually the most similar.
+
+        Returns:
+            tuple: The homonym and its similarity score, or (None, None) if the lattice has no homonyms.
+
+        Notes:
+            The result is approximate. The homonym is chosen with the distance of get_best_distances,
+            which only allows transpositions of adjacent characters, and its score is then computed
+            with the Damerau-Levenshtein distance. When the two distances differ, another homonym
+            may have a better score, e.g. 'b2Na b a' against the lattice of 'ab #' gives 'ab Numero'
+            (0.222) where 'ab Nro' scores 0.25. Use get_path_scores when the best score must be exact.
+        """
+        best_homonym, best_score = None, None
+
+        for homonym_length, (homonym, distance) in self.get_best_distances().items():
+            score = 1 - distance / max(len(self.original_address), homonym_length, 1)
+            if best_score is None or score > best_score:
+                best_homonym, best_score = homonym, score
+
+        if best_homonym is None:
+            return None, None
+
+        # The score of the chosen homonym is computed with the exact distance
+        return best_homonym, AddressSimilarity(None, []).get_similarity_score(self.original_address, best_homonym)
+
+    def get_path_scores(self):
+        """
+        Calculates and returns the similarity score between the original address and every homonym of the lattice.
+
+        Returns:
+            dict: A dictionary with the similarity score for each homonym, in the order of
+                HomonymsGenerator.iter_homonyms.
+
+        Notes:
+            This method expands every path of the lattice: the result has one score per homonym, so
+            its size is the product of the options, whatever the algorithm. The homonyms are scored
+            with CandidateTrie, which shares the work between homonyms with a common prefix, but the
+            merged columns of get_best_distances cannot be used, as they keep one path per state.
+            It is meant to check get_best_score and to inspect small lattices. To find the most
+            similar homonym, use get_best_score, which does not expand the lattice.
+        """
+        tokens = [token for token, _ in self.lattice]
+        homonyms = (' '.join(combination[::-1])
+                    for combination in itertools.product(*reversed([options for _, options in self.lattice]))
+                    if list(combination[::-1]) != tokens)
+        return AddressSimilarity(self.original_address, homonyms).get_batch_scores()
+
+
+# Addresses and prefix tree of the current worker process, set by init_pairwise_worker
+worker_addresses = []
+worker_trie = None
+
+
+def init_pairwise_worker(addresses):
+    """
+    Initializes a worker process of PairwiseSimilarity with the addresses to compare, so they
+    are sent once per process and not once per chunk.
+
+    Args:
+        addresses (list): The list of addresses.
+    """
+    global worker_addresses, worker_trie
+    worker_addresses = addresses
+    worker_trie = CandidateTrie(addresses)
+
+
+def score_pairwise_rows(rows, threshold=None):
+    """
+    Calculates the similarity scores of some rows of the all-pairs score matrix in a worker process.
+
+    Args:
+        rows (list): The indexes of the rows.
+        threshold (float, optional): The threshold for the similarity score. If given, only the pairs
+            with a score above the threshold are returned.
+
+    Returns:
+        list: Tuples (i, scores) with the scores of the address i against the addresses j > i if there
+            is no threshold, otherwise tuples (i, j, score) for the pairs i < j above the threshold.
+    """
+    similarity = AddressSimilarity(None, [])
+    results = []
+
+    for i in rows:
+        address = worker_addresses[i]
+
+        if threshold is None:
+            # The matrix is symmetric, so only the upper triangle is computed
+            distances = worker_trie.get_distances(address, i + 1)
+            scores = [1 - distances[other] / max(len(address), len(other), 1) for other in worker_addresses[i + 1:]]
+            results.append((i, scores))
+        else:
+            for j in range(i + 1, len(worker_addresses)):
+                score = similarity.get_similarity_score(address, worker_addresses[j], threshold)
+                if score is not None:
+                    results.append((i, j, float(score)))
+
+    return results
+
+
+class PairwiseSimilarity:
+    """
+    Calculates the similarity between every pair of addresses of a list, splitting the work
+    in chunks of rows across a pool of processes.
+    """
+    def __init__(self, addresses, max_workers=None, chunks_per_worker=4):
+        """
+        Initializes the PairwiseSimilarity object with the given addresses.
+
+        Args:
+            addresses (list): The list of addresses.
+            max_workers (int, optional): The number of processes. Defaults to the number of CPUs.
+            chunks_per_worker (int): The number of chunks of rows given to each process, more chunks
+                balance the load better.
+        """
+        self.addresses = list(addresses)
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.chunks_per_worker = chunks_per_worker
+
+    def get_chunks(self, addresses):
+        """
+        Splits the rows of the score matrix of some addresses in chunks.
+
+        Args:
+            addresses (list): The addresses of the rows.
+
+        Returns:
+            list: A list of lists of row indexes.
+
+        Notes:
+            The chunks take every n-th row, so each chunk gets short and long rows of the upper triangle.
+        """
+        n_chunks = min(len(addresses), self.max_workers * self.chunks_per_worker) or 1
+        return [list(range(start, len(addresses), n_chunks)) for start in range(n_chunks)]
+
+    def run_chunks(self, addresses, threshold):
+        """
+        Runs the chunks of rows in the pool of processes.
+
+        Args:
+            addresses (list): The addresses to compare.
+            threshold (float): The threshold for the similarity score, or None.
+
+        Returns:
+            list: The results of score_pairwise_rows for every chunk.
+        """
+        chunks = self.get_chunks(addresses)
+
+        with ProcessPoolExecutor(max_workers=self.max_workers, initializer=init_pairwise_worker,
+                                 initargs=(addresses,)) as executor:
+            return list(executor.map(score_pairwise_rows, chunks, [threshold] * len(chunks)))
+
+    def get_score_matrix(self):
+        """
+        Calculates and returns the similarity score between every pair of addresses.
+
+        Returns:
+            numpy.ndarray: A symmetric float32 matrix where the entry (i, j) is the similarity score
+                between the addresses i and j.
+        """
+        # A repeated address has the same scores, so the scores are computed between the distinct addresses
+        distinct_addresses = list(dict.fromkeys(self.addresses))
+        score_matrix = np.ones((len(distinct_addresses), len(distinct_addresses)), dtype=np.float32)
+
+        # The workers compute the pairs i < j, which are mirrored to the lower triangle
+        for results in self.run_chunks(distinct_addresses, None):
+            for i, scores in results:
+                score_matrix[i, i + 1:] = scores
+                score_matrix[i + 1:, i] = scores
+
+        positions = {address: position for position, address in enumerate(distinct_addresses)}
+        indexes = [positions[address] for address in self.addresses]
+        return score_matrix[np.ix_(indexes, indexes)]
+
+    def get_similar_pairs(self, threshold):
+        """
+        Calculates and returns the pairs of addresses with a similarity score above the threshold.
+
+        Args:
+            threshold (float): The threshold for the similarity score.
+
+        Returns:
+            list: A sorted list of tuples (i, j, score) with i < j, the indexes of the addresses in the list.
+        """
+        pairs = []
+        for results in self.run_chunks(self.addresses, threshold):
+            pairs.extend(results)
+        return sorted(pairs)
+
+
 if __name__ == "__main__":
+    from generate_homonyms import HomonymsGenerator
+    import random
+    import timeit
+
     # Test the Damerau-Levenshtein distance function
     print("Test the Damerau-Levenshtein distance function")
 
@@ -190,3 +1261,165 @@ if __name__ == "__main__":
     threshold = 0.9
     filtered_addresses = similarity.filter_best_scores(scores, threshold)
     print("Filtered addresses with more than {}% similarity are {}".format(threshold * 100, filtered_addresses))
+    print("\n")
+
+    # Benchmark the bit-parallel engine against the matrix reference
+    print("Benchmark the bit-parallel engine against the matrix reference")
+
+    random.seed(0)
+    generator = HomonymsGenerator()
+    base_addresses = ["Carrera 78A No 47-15", "CRA 70 # 26A - 33", "Cl. 30 # 43 - 17",
+                      "Calle 43A Numero 1 - 50", "Kra 57A Num 62 - 92"]
+
+    # Each address against its homonyms, as in the main pipeline
+    homonym_pairs = [(address, homonym) for address in base_addresses
+                     for homonym in generator.generate_homonyms(address)]
+
+    # Each address against copies with a few typos (substitutions, insertions and deletions)
+    typo_pairs = []
+    for _ in range(1000):
+        address = random.choice(base_addresses)
+        typo_address = list(address)
+        for _ in range(random.randint(0, 3)):
+            position = random.randrange(len(typo_address))
+            operation = random.choice(["substitution", "insertion", "deletion"])
+            if operation == "substitution":
+                typo_address[position] = random.choice("aeCK#-0123456789 ")
+            elif operation == "insertion":
+                typo_address.insert(position, random.choice("aeCK#-0123456789 "))
+            else:
+                del typo_address[position]
+        typo_pairs.append((address, "".join(typo_address)))
+
+    for name, pairs in [("homonyms", homonym_pairs), ("typos", typo_pairs)]:
+        distances = {}
+        times = {}
+        for engine in DamerauLevenshteinDistance.engines:
+            distances[engine] = [DamerauLevenshteinDistance(first, second, engine).calculate_distance()
+                                 for first, second in pairs]
+            times[engine] = min(timeit.repeat(
+                lambda: [DamerauLevenshteinDistance(first, second, engine).calculate_distance()
+                         for first, second in pairs],
+                number=1, repeat=3))
+            print("{} pairs, engine {}: {:.1f} microseconds per pair".format(
+                name, engine, times[engine] / len(pairs) * 1e6))
+
+        print("Same distances in both engines: {}".format(distances['bit-parallel'] == distances['matrix']))
+        print("Bit-parallel speedup: {:.1f}x".format(times['matrix'] / times['bit-parallel']))
+    print("\n")
+
+    # Benchmark the bounded distance against the full distance
+    print("Benchmark the bounded distance against the full distance")
+
+    threshold = 0.9
+    homonyms_by_address = {address: generator.generate_homonyms(address) for address in base_addresses}
+
+    def score_full():
+        return {address: similarity.filter_best_scores(
+                    AddressSimilarity(address, homonyms).get_all_scores(), threshold)
+                for address, homonyms in homonyms_by_address.items()}
+
+    def score_bounded():
+        return {address: list(AddressSimilarity(address, homonyms).get_all_scores(threshold).keys())
+                for address, homonyms in homonyms_by_address.items()}
+
+    full_time = min(timeit.repeat(score_full, number=1, repeat=3))
+    bounded_time = min(timeit.repeat(score_bounded, number=1, repeat=3))
+    print("Same filtered addresses: {}".format(score_full() == score_bounded()))
+    print("Full distance: {:.2f} ms, bounded distance: {:.2f} ms, speedup: {:.1f}x".format(
+        full_time * 1e3, bounded_time * 1e3, full_time / bounded_time))
+    print("\n")
+
+    # Benchmark the prefix-sharing batch scores against the scores of each homonym
+    print("Benchmark the prefix-sharing batch scores against the scores of each homonym")
+
+    similarities = [AddressSimilarity(address, homonyms) for address, homonyms in homonyms_by_address.items()]
+    trie_nodes = sum(CandidateTrie(homonyms).size for homonyms in homonyms_by_address.values())
+    homonym_chars = sum(len(homonym) for homonyms in homonyms_by_address.values() for homonym in homonyms)
+    print("Characters to read: {} in the homonyms, {} in the prefix trees".format(homonym_chars, trie_nodes))
+
+    all_time = min(timeit.repeat(lambda: [similarity.get_all_scores() for similarity in similarities],
+                                 number=1, repeat=3))
+    batch_time = min(timeit.repeat(lambda: [similarity.get_batch_scores() for similarity in similarities],
+                                   number=1, repeat=3))
+    print("Same scores: {}".format([similarity.get_all_scores() for similarity in similarities]
+                                   == [similarity.get_batch_scores() for similarity in similarities]))
+    print("Each homonym: {:.2f} ms, batch: {:.2f} ms, speedup: {:.1f}x".format(
+        all_time * 1e3, batch_time * 1e3, all_time / batch_time))
+    print("\n")
+
+    # Benchmark the all-pairs similarity with different numbers of processes
+    print("Benchmark the all-pairs similarity with different numbers of processes")
+
+    all_addresses = [address for address, _ in typo_pairs[:100]] + [typo for _, typo in typo_pairs[:100]]
+    n_pairs = len(all_addresses) * (len(all_addresses) - 1) // 2
+
+    worker_counts = sorted({1, os.cpu_count() or 1})
+    for max_workers in worker_counts:
+        pairwise = PairwiseSimilarity(all_addresses, max_workers=max_workers)
+        matrix_time = min(timeit.repeat(pairwise.get_score_matrix, number=1, repeat=1))
+        pairs_time = min(timeit.repeat(lambda: pairwise.get_similar_pairs(threshold), number=1, repeat=1))
+        print("{} processes: score matrix {:.0f} pairs/s, pairs above {} {:.0f} pairs/s".format(
+            max_workers, n_pairs / matrix_time, threshold, n_pairs / pairs_time))
+
+    score_matrix = pairwise.get_score_matrix()
+    similar_pairs = pairwise.get_similar_pairs(threshold)
+    print("Score matrix of shape {} and {} pairs above {}".format(score_matrix.shape, len(similar_pairs), threshold))
+    expected_pairs = [(i, j) for i in range(len(all_addresses)) for j in range(i + 1, len(all_addresses))
+                      if AddressSimilarity(None, []).get_similarity_score(all_addresses[i], all_addresses[j]) >= threshold]
+    print("Same pairs as the full scores: {}".format([(i, j) for i, j, _ in similar_pairs] == expected_pairs))
+    print("Largest difference with the score matrix: {:.1e}".format(
+        max(abs(score - float(score_matrix[i, j])) for i, j, score in similar_pairs)))
+    print("\n")
+
+    # Test the q-gram prefilter on a large set of homonyms
+    print("Test the q-gram prefilter on a large set of homonyms")
+
+    candidates = [homonym for homonyms in homonyms_by_address.values() for homonym in homonyms]
+    candidates += [typo for _, typo in typo_pairs]
+    prefilter = QGramIndex(candidates)
+
+    for address in base_addresses:
+        similarity = AddressSimilarity(address, candidates)
+        filtered_similarity = AddressSimilarity(address, candidates, prefilter)
+
+        full_time = min(timeit.repeat(lambda: similarity.get_all_scores(threshold), number=1, repeat=3))
+        filtered_time = min(timeit.repeat(lambda: filtered_similarity.get_all_scores(threshold), number=1, repeat=3))
+        same_scores = similarity.get_all_scores(threshold) == filtered_similarity.get_all_scores(threshold)
+
+        print("{}: removed by stage {}, same scores: {}, {:.1f} ms without and {:.1f} ms with prefilter".format(
+            address, filtered_similarity.stage_counts, same_scores, full_time * 1e3, filtered_time * 1e3))
+
+    # The homonyms missing from the index are scored with the exact distance
+    address = base_addresses[0]
+    unindexed = candidates + generator.generate_homonyms(address.replace('A', 'B'))
+    filtered_similarity = AddressSimilarity(address, unindexed, prefilter)
+    same_scores = AddressSimilarity(address, unindexed).get_all_scores(threshold) == \
+        filtered_similarity.get_all_scores(threshold)
+    print("{} with homonyms missing from the index: {}, same scores: {}".format(
+        address, filtered_similarity.stage_counts, same_scores))
+    print("\n")
+
+    # Test the scores against the replacement lattice, without expanding the homonyms
+    print("Test the scores against the replacement lattice, without expanding the homonyms")
+
+    for address in base_addresses:
+        lattice = generator.get_lattice(address)
+        homonyms = generator.generate_homonyms(address)
+        lattice_similarity = LatticeSimilarity(address, lattice)
+
+        best_homonym, best_score = lattice_similarity.get_best_score()
+        expanded_scores = AddressSimilarity(address, homonyms).get_all_scores()
+        same_scores = lattice_similarity.get_path_scores() == expanded_scores
+
+        lattice_time = min(timeit.repeat(lattice_similarity.get_best_score, number=1, repeat=3))
+        expanded_time = min(timeit.repeat(lambda: AddressSimilarity(address, homonyms).get_all_scores(), number=1, repeat=3))
+        print("{}: best {} ({:.3f}), best expanded {:.3f}, same path scores: {}, {:.1f} ms lattice and {:.1f} ms expanded".format(
+            address, best_homonym, best_score, max(expanded_scores.values()), same_scores, lattice_time * 1e3, expanded_time * 1e3))
+
+    # The homonym of the lattice is chosen with adjacent transpositions only, so it can differ from the best one
+    lattice_similarity = LatticeSimilarity('b2Na b a', generator.get_lattice('ab #'))
+    best_homonym, best_score = lattice_similarity.get_best_score()
+    expanded_homonym, expanded_score = max(lattice_similarity.get_path_scores().items(), key=lambda item: item[1])
+    print("b2Na b a against the lattice of ab #: best {} ({:.3f}), best expanded {} ({:.3f})".format(
+        best_homonym, best_score, expanded_homonym, expanded_score))
@@ -1,4 +1,9 @@
-from PyPDF2 import PdfReader
+from PyPDF2 import PdfReader, PageObject
+from concurrent.futures import ProcessPoolExecutor
+import io
+import mmap
+import os
+import re
 
 class AddressExtractor:
     """
@@ -10,13 +15,60 @@ class AddressExtractor:
 
     """
 
-    def __init__(self, documents):
+    # Version of the extraction logic. It must be changed when the extraction of the addresses
+    # changes, so the addresses cached by the previous version are not used.
+    version = '1'
+
+    # Classifier and address function of each type of document, in the order they are tried,
+    # and marker of the first page of a statement of each type. See register_kind.
+    document_kinds = {}
+    first_page_patterns = {}
+
+    # Attributes that a page inherits from the nodes of the page tree above it
+    inheritable_attributes = ('/Resources', '/MediaBox', '/CropBox', '/Rotate')
+
+    def __init__(self, documents, cache=None):
         """
         Initialize the class with a dictionary of documents and their kinds.
 
-        :param documents: dict, a dictionary where the keys are document file paths and the values are document kinds.
+        :param documents: dict, a dictionary where the keys are document file paths and the values are document kinds,
+            or None to identify the kind of the document from the text of its first page.
+        :param cache: ExtractionCache, optional, a cache of the addresses extracted from documents with the same content.
         """
         self.documents = documents
+        self.cache = cache
+
+        # Errors of the documents that could not be processed by locate_addresses_parallel
+        self.errors = {}
+
+    @classmethod
+    def register_kind(cls, kind, classifier, address_function, first_page_pattern=None):
+        """
+        Register a type of document, so its documents can be identified and their addresses located.
+
+        :param kind: str, the type of document.
+        :param classifier: function, receives the text of the first page of a document and returns True
+            if the document is of this type. The classifiers are tried in the order they were registered.
+        :param address_function: function, receives the extractor, the PDF file and the text of its first
+            page, and returns the address of the client (see get_address_fiduciary).
+        :param first_page_pattern: re.Pattern, optional, a pattern found only in the first page of a
+            statement of this type, to split batch files into statements (see iter_statements).
+        """
+        cls.document_kinds[kind] = (classifier, address_function)
+        if first_page_pattern is not None:
+            cls.first_page_patterns[kind] = first_page_pattern
+
+    def classify(self, text):
+        """
+        Identify the type of a document from the text of its first page.
+
+        :param text: str, the text of the first page.
+        :return: str, the type of document, or None if no classifier recognizes it.
+        """
+        for kind, (classifier, _) in self.document_kinds.items():
+            if classifier(text):
+                return kind
+        return None
     
     def locate_addresses(self):
         """
@@ -29,58 +81,307 @@ class AddressExtractor:
             address = self.locate_address(file, kind)
             addresses[file] = address
         return addresses
+
+    def locate_addresses_parallel(self, max_workers=None, chunk_size=16):
+        """
+        Locate the addresses for all the documents, parsing the documents in parallel processes.
+
+        Parsing a PDF is CPU-bound, so the documents are split into chunks that are processed by
+        a pool of worker processes. A document that cannot be processed does not stop the rest,
+        its error is kept in self.errors.
+
+        :param max_workers: int, the number of worker processes. If None, the number of CPUs.
+        :param chunk_size: int, the number of documents sent to a worker process at a time.
+        :return: dict, a dictionary where the keys are document file paths and the values are the corresponding
+            addresses, in the same order as the documents. The documents with errors are not included.
+        """
+        addresses = {}
+        self.errors = {}
+
+        documents = list(self.documents.items())
+        max_workers = max_workers or os.cpu_count() or 1
+
+        with ProcessPoolExecutor(max_workers=min(max_workers, max(len(documents), 1)),
+                                 initializer=init_extraction_worker, initargs=(self.cache,)) as executor:
+            results = executor.map(locate_document_address, documents, chunksize=chunk_size)
+
+            # The results are returned in the order of the documents
+            for (file, _), (address, error, cache_lookups) in zip(documents, results):
+                if error is None:
+                    addresses[file] = address
+                else:
+                    self.errors[file] = error
+
+                # The workers look up copies of the cache, their counters are added to the one of this process
+                if self.cache is not None:
+                    self.cache.add_lookups(*cache_lookups)
+
+        return addresses
     
-    def locate_address(self, file, kind):
+    def locate_address(self, file, kind=None):
         """
         Locate the address in a given client document.
 
-        :param file: str, the path to the PDF file to be processed.
-        :param kind: str, the type of document. Supported types are 'fiduciary' and 'consolidated'.
+        The document is parsed once: the text of its first page identifies its kind, if it is not
+        given, and the same text goes to the address function of the kind.
+
+        :param file: str, bytes or file-like, the PDF file to be processed (see get_first_page_text).
+        :param kind: str, optional, the type of document. Supported types are the registered ones
+            ('fiduciary' and 'consolidated' by default). If None, it is identified from the document.
         :return: str, the address of the client.
-        :raises ValueError: if the document type is not supported or not specified.
-        """
-        supported_types = {
-        'fiduciary': self.get_address_fiduciary,
-        'consolidated': self.get_address_consolidated
-        }
+        :raises ValueError: if the document type is not supported or cannot be identified.
 
-        if kind not in supported_types:
+        If there is a cache, a document with the same content and kind as a cached one is not parsed.
+        """
+        if kind is not None and kind not in self.document_kinds:
             raise ValueError(f'The type ({kind}) of the document {file} is not supported or not specified.')
 
-        address_function = supported_types[kind]
-        address = address_function(file)
+        if self.cache is not None:
+            file = self.read_content(file)
+            content_hash = self.cache.get_content_hash(file)
+
+            # The documents identified from their content are cached without a kind
+            cached = self.cache.get(content_hash, kind or '')
+            if cached is not None:
+                address, _ = cached
+                return address
+
+        text = self.get_first_page_text(file)
+
+        document_kind = kind or self.classify(text)
+        if document_kind is None:
+            raise ValueError('The type of the document could not be identified from its first page.')
+
+        _, address_function = self.document_kinds[document_kind]
+        address = address_function(self, file, text)
+
+        if self.cache is not None:
+            self.cache.put(content_hash, kind or '', address, text)
         
         return address
+
+    @staticmethod
+    def read_content(file):
+        """
+        Read the content of a PDF file.
+
+        :param file: str, bytes or file-like, the PDF file.
+        :return: bytes or bytes-like, the content of the file.
+        """
+        if isinstance(file, (bytes, bytearray, memoryview, mmap.mmap)):
+            return file
+
+        if hasattr(file, 'read'):
+            return file.read()
+
+        with open(file, 'rb') as f:
+            return f.read()
     
-    def get_address_fiduciary(self, file):
+    def get_first_page_text(self, file):
+        """
+        Extract the text of the first page of a PDF file.
+
+        The file can be a path, the content of the file in memory (bytes, bytearray or memoryview)
+        or a file-like object, e.g. an S3 streaming body or a memory map of a local file, so the
+        documents do not need to be written to disk. Only the first page is located and parsed, the
+        page tree of the rest of the document is never read.
+
+        :param file: str, bytes or file-like, the PDF file to be processed.
+        :return: str, the text of the first page.
+        :raises ValueError: if the document has no pages.
+        """
+        if isinstance(file, (bytes, bytearray, memoryview)):
+            file = io.BytesIO(file)
+        elif hasattr(file, 'read') and not self.is_seekable(file):
+            # The PDF cross-reference table is at the end of the file, so streams are read into memory
+            file = io.BytesIO(file.read())
+
+        pdf = PdfReader(file)
+        return self.get_first_page(pdf).extract_text()
+
+    @staticmethod
+    def is_seekable(file):
+        """
+        Check if a file-like object can be read by PdfReader without copying it to memory.
+
+        :param file: file-like, the file.
+        :return: bool, True if the file supports random access.
+        """
+        # Memory maps support random access, but they only have the seekable method from Python 3.13
+        return isinstance(file, mmap.mmap) or (hasattr(file, 'seekable') and file.seekable())
+
+    @classmethod
+    def get_first_page(cls, pdf):
+        """
+        Locate the first page of a PDF document by following the first branch of its page tree.
+
+        PdfReader.pages builds the list of all the pages of the document, which is slow for long
+        documents when only the first page is needed.
+
+        :param pdf: PdfReader, the PDF document.
+        :return: PageObject, the first page.
+        :raises ValueError: if the document has no pages.
+        """
+        page = next(cls.iter_pages(pdf), None)
+        if page is None:
+            raise ValueError('The document has no pages.')
+        return page
+
+    @classmethod
+    def iter_pages(cls, pdf, node=None, inherited=None, reference=None):
+        """
+        Walk the page tree of a PDF document lazily, yielding the pages in order.
+
+        :param pdf: PdfReader, the PDF document.
+        :param node: DictionaryObject, optional, the node of the tree to walk. If None, the root of the tree.
+        :param inherited: dict, optional, the attributes inherited from the nodes above the node.
+        :param reference: IndirectObject, optional, the reference to the node.
+        :return: Iterator[PageObject], the pages under the node.
+        """
+        if node is None:
+            node = pdf.trailer['/Root'].get_object()['/Pages'].get_object()
+            inherited = {}
+
+        if node.get('/Type', '/Pages') == '/Pages':
+            # Attributes that a page inherits from the nodes of the tree above it
+            inherited = {**inherited, **{attribute: node[attribute] for attribute in cls.inheritable_attributes
+                                         if attribute in node}}
+            for kid in node.get('/Kids', []):
+                yield from cls.iter_pages(pdf, kid.get_object(), inherited, kid)
+        else:
+            page = PageObject(pdf, reference)
+            page.update(inherited)
+            page.update(node)
+            yield page
+
+    def iter_statements(self, file, kind, clear_every=64):
+        """
+        Locate the addresses of the statements of a batch PDF file with many concatenated statements.
+
+        The pages are read lazily and a statement starts at each page numbered 1, so the addresses are
+        yielded as the file is read. A path is read from disk as needed, not loaded in memory, and the
+        objects parsed by PdfReader are dropped every few pages, so the memory does not grow with the
+        size of the file.
+
+        :param file: str, bytes or file-like, the PDF file to be processed (see get_first_page_text).
+        :param kind: str, the type of the statements. Supported types are the registered ones with a first
+            page pattern ('fiduciary' and 'consolidated' by default).
+        :param clear_every: int, the number of pages between drops of the parsed objects.
+        :return: Iterator[tuple], tuples (statement_id, address), where statement_id is the index of the
+            first page of the statement in the file, starting at 0.
+        :raises ValueError: if the document type is not supported or not specified.
+        """
+        if kind not in self.first_page_patterns:
+            raise ValueError(f'The type ({kind}) of the document {file} is not supported or not specified.')
+
+        _, address_function = self.document_kinds[kind]
+        first_page_pattern = self.first_page_patterns[kind]
+
+        if isinstance(file, str):
+            with open(file, 'rb') as stream:
+                yield from self.iter_statements(stream, kind, clear_every)
+            return
+
+        if isinstance(file, (bytes, bytearray, memoryview)):
+            file = io.BytesIO(file)
+        elif not self.is_seekable(file):
+            file = io.BytesIO(file.read())
+
+        pdf = PdfReader(file)
+        for page_number, page in enumerate(self.iter_pages(pdf)):
+            text = page.extract_text()
+
+            # Pages before the first statement, or continuing a statement, are skipped
+            if first_page_pattern.search(text):
+                yield page_number, address_function(self, None, text)
+
+            # The fonts and content streams of the pages read so far are not needed anymore
+            if (page_number + 1) % clear_every == 0:
+                pdf.resolved_objects.clear()
+
+    def get_address_fiduciary(self, file, text=None):
         """
         Locate the address in a fiduciary document.
 
-        :param file: str, the path to the PDF file to be processed.
+        :param file: str, bytes or file-like, the PDF file to be processed (see get_first_page_text).
+        :param text: str, optional, the text of the first page, if it was already extracted.
         :return: str, the address of the client.
         """
-        pdf = PdfReader(file)
-        page_number = 0  # In fiduciary documents, the address is always on the first page.
-        text = pdf.pages[page_number].extract_text() 
+        # In fiduciary documents, the address is always on the first page.
+        if text is None:
+            text = self.get_first_page_text(file)
         lines = text.split('\n')
         address = lines[-1]  # The address is on the last line parsed.
         return address
     
-    def get_address_consolidated(self, file):
+    def get_address_consolidated(self, file, text=None):
         """
         Locate the address in a consolidated document.
 
-        :param file: str, the path to the PDF file to be processed.
+        :param file: str, bytes or file-like, the PDF file to be processed (see get_first_page_text).
+        :param text: str, optional, the text of the first page, if it was already extracted.
         :return: str, the address of the client.
         """
-        pdf = PdfReader(file)
-        page_number = 0  # In consolidated documents, the address is always on the first page.
-        text = pdf.pages[page_number].extract_text()
+        # In consolidated documents, the address is always on the first page.
+        if text is None:
+            text = self.get_first_page_text(file)
         lines = text.split('\n')
         address = lines[-1]  # The address is on the last line parsed.
         return address
 
 
+# Fiduciary documents are issued by the trust company, and consolidated documents number their
+# pages as "Página: n" at the top of the page
+AddressExtractor.register_kind(
+    'fiduciary',
+    lambda text: 'FIDUCIARIA BANCOLOMBIA' in text,
+    AddressExtractor.get_address_fiduciary,
+    re.compile(r'Pág\. 1(?!\d)'))
+AddressExtractor.register_kind(
+    'consolidated',
+    lambda text: re.search(r'^Página: \d', text, re.MULTILINE) is not None,
+    AddressExtractor.get_address_consolidated,
+    re.compile(r'^Página: 1(?!\d)', re.MULTILINE))
+
+
+# Extraction cache of the current worker process, set by init_extraction_worker
+worker_cache = None
+
+
+def init_extraction_worker(cache):
+    """
+    Initialize a worker process of AddressExtractor.locate_addresses_parallel with the extraction cache,
+    so it is sent once per process and not once per document.
+
+    :param cache: ExtractionCache, the cache of the extractor, or None.
+    """
+    global worker_cache
+    worker_cache = cache
+
+
+def locate_document_address(document):
+    """
+    Locate the address of a document in a worker process of AddressExtractor.locate_addresses_parallel.
+
+    :param document: tuple, the path to the PDF file and the type of document.
+    :return: tuple, the address of the client and None, or None and the error if the document could not be processed,
+        followed by the hits and misses of the extraction cache of the worker for this document.
+    """
+    file, kind = document
+    hits, misses = (worker_cache.hits, worker_cache.misses) if worker_cache is not None else (0, 0)
+
+    try:
+        address, error = AddressExtractor({}, cache=worker_cache).locate_address(file, kind), None
+    except Exception as exception:
+        # The exceptions of the PDF library may not be picklable, so only their description is returned
+        address, error = None, f'{type(exception).__name__}: {exception}'
+
+    if worker_cache is not None:
+        hits, misses = worker_cache.hits - hits, worker_cache.misses - misses
+
+    return address, error, (hits, misses)
+
+
 if __name__ == '__main__':
     # Test for extract addresses from multiple documents with associated types.
     print("Test for extract addresses from multiple documents with associated types.\n")
@@ -113,6 +414,75 @@ if __name__ == '__main__':
 
 
 
+    # Test for extract addresses from multiple documents in parallel, with a missing document.
+    print("Test for extract addresses from multiple documents in parallel, with a missing document.\n")
+
+    documents = {
+        "Doc 1.pdf": "consolidated",
+        "Missing Doc.pdf": "consolidated",
+        "Doc 2.pdf": "fiduciary"
+    }
+
+    extractor = AddressExtractor(documents)
+    addresses = extractor.locate_addresses_parallel(max_workers=2, chunk_size=1)
+
+    for file, address in addresses.items():
+        print(f"Document: {file}")
+        print(f"Address: {address}")
+        print("\n")
+
+    for file, error in extractor.errors.items():
+        print(f"Document: {file}")
+        print(f"Error: {error}")
+        print("\n")
+
+
+
+    # Test for extract addresses from documents of unknown type, identified from their content.
+    print("Test for extract addresses from documents of unknown type, identified from their content.\n")
+
+    documents = {
+        "Doc 1.pdf": None,
+        "Doc 2.pdf": None
+    }
+
+    extractor = AddressExtractor(documents)
+    for file in documents:
+        text = extractor.get_first_page_text(file)
+        print(f"Document: {file}")
+        print(f"Type: {extractor.classify(text)}")
+        print(f"Address: {extractor.locate_address(file)}")
+        print("\n")
+
+
+
+    # Test for extract address from a document in memory, without reading it from disk.
+    print("Test for extract address from a document in memory, without reading it from disk.\n")
+
+    with open("Doc 1.pdf", "rb") as f:
+        content = f.read()
+
+    extractor = AddressExtractor({})
+    for document in [content, memoryview(content), io.BytesIO(content)]:
+        address = extractor.locate_address(document, "consolidated")
+        print(f"Document: {type(document).__name__}")
+        print(f"Address: {address}")
+        print("\n")
+
+
+
+    # Test for extract the addresses of the statements of a batch file, page by page.
+    print("Test for extract the addresses of the statements of a batch file, page by page.\n")
+
+    file = "Batch.pdf"
+    extractor = AddressExtractor({})
+    for statement_id, address in extractor.iter_statements(file, "consolidated"):
+        print(f"Statement starting at page: {statement_id}")
+        print(f"Address: {address}")
+        print("\n")
+
+
+
     # Test for extract address from a single document with an unsupported type.
     print("Test for extract address from a single document with an unsupported type.\n")
 
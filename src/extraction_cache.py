@@ -0,0 +1,166 @@
+import hashlib
+import os
+
+from sqlite_cache import SQLiteCache
+
+
+class ExtractionCache(SQLiteCache):
+    """
+    A cache of the addresses extracted from PDF documents.
+
+    The entries are keyed by the hash of the content of the document and its kind, so a
+    document that has not changed is found again even if it is renamed or downloaded again.
+    Each entry is tagged with the version of the extractor that wrote it, and the entries of
+    other versions are ignored, so changing the extraction logic only needs a new version.
+    """
+
+    def __init__(self, file_path, version):
+        """
+        Initializes the ExtractionCache object.
+
+        Args:
+            file_path (str): The path to the SQLite file.
+            version (str): The version of the extractor. The entries written by other versions are not used.
+        """
+        super().__init__(file_path)
+        self.version = version
+
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_content_hash(content):
+        """
+        Returns the hash of the content of a document.
+
+        Args:
+            content (bytes): The content of the document.
+
+        Returns:
+            str: The hexadecimal SHA-256 digest of the content.
+        """
+        return hashlib.sha256(content).hexdigest()
+
+    def create_tables(self, connection):
+        """
+        Creates the table of the extractions, if it does not exist.
+
+        Args:
+            connection (sqlite3.Connection): The new connection to the SQLite file.
+        """
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS extractions ('
+            'content_hash TEXT NOT NULL, kind TEXT NOT NULL, version TEXT NOT NULL, '
+            'address TEXT NOT NULL, text TEXT NOT NULL, '
+            'PRIMARY KEY (content_hash, kind))')
+
+    def get(self, content_hash, kind):
+        """
+        Returns the cached extraction of a document.
+
+        Args:
+            content_hash (str): The hash of the content of the document.
+            kind (str): The type of document.
+
+        Returns:
+            tuple: The address and the text of the first page, or None if the document is not cached
+                by the current version of the extractor.
+        """
+        row = self.get_connection().execute(
+            'SELECT address, text FROM extractions WHERE content_hash = ? AND kind = ? AND version = ?',
+            (content_hash, kind, self.version)).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        return row
+
+    def put(self, content_hash, kind, address, text):
+        """
+        Caches the extraction of a document, replacing the entry of any other version.
+
+        Args:
+            content_hash (str): The hash of the content of the document.
+            kind (str): The type of document.
+            address (str): The extracted address.
+            text (str): The text of the first page.
+        """
+        with self.get_connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO extractions VALUES (?, ?, ?, ?, ?)',
+                               (content_hash, kind, self.version, address, text))
+
+    def add_lookups(self, hits, misses):
+        """
+        Adds the lookups made by a copy of the cache, e.g. in a worker process, to the counters.
+
+        Args:
+            hits (int): The number of hits of the copy.
+            misses (int): The number of misses of the copy.
+        """
+        self.hits += hits
+        self.misses += misses
+
+    def clear_other_versions(self):
+        """
+        Deletes the entries written by other versions of the extractor.
+
+        Returns:
+            int: The number of deleted entries.
+        """
+        with self.get_connection() as connection:
+            return connection.execute('DELETE FROM extractions WHERE version != ?', (self.version,)).rowcount
+
+    def get_stats(self):
+        """
+        Returns the counters of the cache.
+
+        Returns:
+            dict: The hits, misses and hit rate, including the lookups added from the worker processes.
+        """
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    from extract_address import AddressExtractor
+    import tempfile
+
+    # Test the cache of extracted addresses
+    print("Test the cache of extracted addresses")
+
+    documents = {
+        "Doc 1.pdf": "consolidated",
+        "Doc 2.pdf": "fiduciary"
+    }
+    file_path = os.path.join(tempfile.mkdtemp(), 'extraction_cache.sqlite')
+
+    cache = ExtractionCache(file_path, AddressExtractor.version)
+    extractor = AddressExtractor(documents, cache=cache)
+    print("Addresses in the first run: {}".format(extractor.locate_addresses()))
+    print("Addresses in the second run: {}".format(extractor.locate_addresses()))
+    print("Stats: {}".format(cache.get_stats()))
+    print("\n")
+
+    # Test the counters of the lookups made by the worker processes
+    print("Test the counters of the lookups made by the worker processes")
+
+    print("Addresses in parallel: {}".format(extractor.locate_addresses_parallel(max_workers=2, chunk_size=1)))
+    print("Stats: {}".format(cache.get_stats()))
+    cache.close()
+    print("\n")
+
+    # Test the invalidation of the cache by a new version of the extractor
+    print("Test the invalidation of the cache by a new version of the extractor")
+
+    cache = ExtractionCache(file_path, AddressExtractor.version + '-new')
+    print("Entries of other versions deleted: {}".format(cache.clear_other_versions()))
+    extractor = AddressExtractor(documents, cache=cache)
+    print("Addresses with the new version: {}".format(extractor.locate_addresses()))
+    print("Stats: {}".format(cache.get_stats()))
+    cache.close()
@@ -1,5 +1,9 @@
 import csv
+import hashlib
+import itertools
+import json
 import numpy as np
+import re
 
 class HomonymsGenerator:
     """
@@ -10,6 +14,11 @@ class HomonymsGenerator:
         3. Return the combinations.
     """
 
+    # A token is a '#', a '-', a word with an optional final dot (e.g. "Cra."), a number with
+    # its letters (e.g. "26A") or any other symbol, so "Cra.57a #62-92" gives
+    # ['Cra.', '57a', '#', '62', '-', '92']
+    token_pattern = re.compile(r'#|-|[^\W\d_]+\.?|\d\w*|\S')
+
     def __init__(self):
         """
         Initialize the class. 
@@ -20,6 +29,69 @@ class HomonymsGenerator:
             '#': ['Nro', 'Numero', 'Num', '#'],
             '-': [' ', '-']}
 
+        self.build_index()
+
+    def build_index(self):
+        """
+        Build the reverse index from each replacement to its category. It must be called again
+        if word_replacements is modified.
+        """
+        self.token_categories = {}
+
+        # The expansion templates depend on the replacements, so they are built again
+        self.templates = {}
+        for category, replacements in self.word_replacements.items():
+            for replacement in replacements:
+                token = self.normalize_token(replacement)
+
+                # Whitespace replacements are not tokens, and the first category of a token wins
+                if token:
+                    self.token_categories.setdefault(token, category)
+
+    def get_rules_hash(self):
+        """
+        Get a hash of the rules that generate the homonyms, i.e. the token pattern and the word
+        replacements, to tell apart the homonyms stored by a generator with other rules.
+
+        :return: The hexadecimal SHA-256 digest of the rules.
+        :rtype: str
+        """
+        rules = json.dumps([self.token_pattern.pattern, self.word_replacements], sort_keys=True)
+        return hashlib.sha256(rules.encode('utf-8')).hexdigest()
+
+    def normalize_token(self, token):
+        """
+        Normalize a token to look it up in the reverse index, ignoring the case and a final dot.
+
+        :param token: The token to normalize.
+        :type token: str
+        :return: The normalized token.
+        :rtype: str
+        """
+        return token.strip().rstrip('.').casefold() or token.strip()
+
+    def tokenize(self, address):
+        """
+        Split the given address into tokens in a single regular expression pass.
+
+        :param address: The address to split.
+        :type address: str
+        :return: The tokens of the address.
+        :rtype: list[str]
+        """
+        return self.token_pattern.findall(address)
+
+    def get_category(self, token):
+        """
+        Get the category of the given token.
+
+        :param token: The token to look up.
+        :type token: str
+        :return: The category of the token, or None if it has no replacements.
+        :rtype: str
+        """
+        return self.token_categories.get(self.normalize_token(token))
+
 
     def generate_homonyms(self, address):
         """
@@ -30,46 +102,198 @@ class HomonymsGenerator:
         :return: A list of possible homonyms for the address.
         :rtype: list[str]
         """
-        # Split the address into individual words
-        words = address.split()
+        return list(self.iter_homonyms(address))
+
+    def iter_homonyms(self, address, max_homonyms=None):
+        """
+        Yield the homonyms for the given address one at a time, in the same order as generate_homonyms.
+
+        Only the current combination of words is kept in memory, so an address with many
+        replaceable words does not build the full list of homonyms.
+
+        :param address: The address to generate homonyms for.
+        :type address: str
+        :param max_homonyms: The maximum number of homonyms to yield, all of them if None.
+        :type max_homonyms: int, optional
+        :return: A generator of possible homonyms for the address.
+        :rtype: Iterator[str]
+        """
+        lattice = self.get_lattice(address)
+        words = [word for word, _ in lattice]
+        options = [word_options for _, word_options in lattice]
+
+        # The replacements of the last words change the slowest, so the combinations are
+        # taken over the reversed options and reversed back
+        count = 0
+        for combination in itertools.product(*reversed(options)):
+            if max_homonyms is not None and count >= max_homonyms:
+                return
+
+            homonym = combination[::-1]
+
+            # Drop the original address from the homonyms
+            if list(homonym) == words:
+                continue
+
+            count += 1
+            yield ' '.join(homonym)
+
+    def get_lattice(self, address):
+        """
+        Get the replacement lattice of the given address: its tokens with their options, without
+        expanding the combinations.
 
-        # Initialize a list to store homonyms, starting with an empty list
-        homonyms = [[]]
+        :param address: The address to get the lattice for.
+        :type address: str
+        :return: A list of tuples (token, options), where the options are the replacements of the
+            category of the token, or only the token itself if it has no replacements.
+        :rtype: list[tuple[str, list[str]]]
+        """
+        lattice = []
+        for word in self.tokenize(address):
+            category = self.get_category(word)
+
+            if category is None:
+                lattice.append((word, [word]))
+            else:
+                lattice.append((word, self.word_replacements[category]))
+
+        return lattice
+
+    def get_shape(self, address):
+        """
+        Split the given address into its shape and the values of its slots.
+
+        The shape has one entry per token: None for a token without replacements, which is a slot
+        filled with a value of the address, or a tuple (category, index) for a token with
+        replacements, where index is the position of the token in the replacements of the
+        category (-1 if it is not one of them). Addresses like "CRA 70 # 26A - 33" and
+        "CRA 57A # 62 - 92" have the same shape and differ only in the values of the slots.
+
+        :param address: The address to split.
+        :type address: str
+        :return: The shape of the address and the values of its slots.
+        :rtype: tuple[tuple, list[str]]
+        """
+        shape = []
+        values = []
+        for word in self.tokenize(address):
+            category = self.get_category(word)
+
+            if category is None:
+                shape.append(None)
+                values.append(word)
+            else:
+                replacements = self.word_replacements[category]
+                shape.append((category, replacements.index(word) if word in replacements else -1))
+
+        return tuple(shape), values
+
+    def get_template(self, shape):
+        """
+        Get the expansion template of the given shape, building it the first time the shape is found.
+
+        The template is a format string with one line per homonym, in the same order as
+        iter_homonyms, with the replacements already written and a field for each slot value, so
+        all the homonyms of an address are written with a single call to format. The tokens never
+        contain whitespace, so the lines can be split back safely.
+
+        :param shape: The shape of an address, as returned by get_shape.
+        :type shape: tuple
+        :return: The format string of the homonyms of the shape, or None if it has no homonyms.
+        :rtype: str
+        """
+        if shape in self.templates:
+            return self.templates[shape]
+
+        options = []
+        original = []
+        slot = 0
+        for entry in shape:
+            if entry is None:
+                options.append(['{' + str(slot) + '}'])
+                original.append(0)
+                slot += 1
+            else:
+                category, index = entry
+                options.append([replacement.replace('{', '{{').replace('}', '}}')
+                                for replacement in self.word_replacements[category]])
+                original.append(index)
+
+        # Walk the combinations of option indexes, so the original address is found by position
+        homonyms = []
+        for combination in itertools.product(*reversed([range(len(word_options)) for word_options in options])):
+            combination = combination[::-1]
+            if list(combination) == original:
+                continue
+            homonyms.append(' '.join(word_options[i] for word_options, i in zip(options, combination)))
+
+        self.templates[shape] = '\n'.join(homonyms) if homonyms else None
+        return self.templates[shape]
+
+    def generate_homonyms_batch(self, addresses):
+        """
+        Generate the homonyms for each of the given addresses.
+
+        The addresses are split into their shape and slot values, and the homonyms come from the
+        cached template of the shape, so the replacements are only combined once per shape and
+        not once per address.
 
-        # Iterate through each word in the address
-        for word in words:
-            found_replacements = False
+        :param addresses: The addresses to generate homonyms for.
+        :type addresses: list[str]
+        :return: The homonyms of each address, in the same order as generate_homonyms.
+        :rtype: dict[str, list[str]]
+        """
+        homonyms = {}
+        for address in addresses:
+            if address in homonyms:
+                continue
+
+            shape, values = self.get_shape(address)
+            template = self.get_template(shape)
+            homonyms[address] = template.format(*values).split('\n') if template is not None else []
 
-            # Iterate through each category and its associated replacements
-            for category, replacements in self.word_replacements.items():
+        return homonyms
 
-                # Check if the word has any replacements in the current category
-                if word in replacements:
-                    found_replacements = True
+    def get_canonical_key(self, address):
+        """
+        Get the canonical key of the given address.
 
-                    # Create a new list to store updated homonyms
-                    new_homonyms = []
+        Every word with replacements is mapped to the name of its category, so all the homonyms
+        of an address share the same key and exact duplicates can be found with a hash lookup.
+        The '-' separators are dropped and the rest of the words are upper-cased.
+
+        :param address: The address to get the key for.
+        :type address: str
+        :return: The canonical key of the address.
+        :rtype: str
+        """
+        key = []
+        for word in self.tokenize(address):
+            category = self.get_category(word)
 
-                    # Iterate through each replacement for the word
-                    for replacement in replacements:
+            if category is None:
+                key.append(word.upper())
 
-                        # Iterate through each existing homonym
-                        for homonym in homonyms:
-                            # Append the replacement to each homonym and add it to the new list
-                            new_homonyms.append(homonym + [replacement])
+            # Separators do not change the address, so they are dropped from the key
+            elif category != '-':
+                key.append(f'<{category}>')
 
-                    # Update the list of homonyms with the new list
-                    homonyms = new_homonyms
+        return ' '.join(key)
 
-            # If no replacements were found for the word, append it to each existing homonym
-            if not found_replacements:
-                for homonym in homonyms:
-                    homonym.append(word)
-                    
-        # Drop the original address from the list of homonyms
-        homonyms = [homonym for homonym in homonyms if homonym != words]
+    def group_by_canonical_key(self, addresses):
+        """
+        Group the given addresses by their canonical key.
 
-        return [' '.join(homonym) for homonym in homonyms]
+        :param addresses: The addresses to group.
+        :type addresses: list[str]
+        :return: The addresses of each canonical key, in the order they were found.
+        :rtype: dict[str, list[str]]
+        """
+        groups = {}
+        for address in addresses:
+            groups.setdefault(self.get_canonical_key(address), []).append(address)
+        return groups
 
     def export_csv(self, homonyms, output_file_path):
         """
@@ -118,6 +342,8 @@ class HomonymsGenerator:
         return addresses
     
 if __name__ == '__main__':
+    import timeit
+
     # Test for generate multiple homonyms with different words and symbols
     print("Test for generate multiple homonyms with different words and symbols")
     
@@ -139,6 +365,40 @@ if __name__ == '__main__':
     print(f'Homonyms: {homonyms}')
     print('------------------------')
 
+    # Test for generate a limited number of homonyms lazily
+    print("Test for generate a limited number of homonyms lazily")
+
+    address = 'CRA 70 # 26A - 33'
+    for homonym in generator.iter_homonyms(address, max_homonyms=5):
+        print(f'Homonym: {homonym}')
+    print('------------------------')
+
+    # Test for the canonical key of addresses written in different ways
+    print("Test for the canonical key of addresses written in different ways")
+
+    addresses = ['CRA 70 # 26A - 33', 'Carrera 70 Nro 26A 33', 'kra 70 numero 26a - 33', 'Cl. 30 # 43 - 17']
+    groups = generator.group_by_canonical_key(addresses)
+    for key, group in groups.items():
+        print(f'Canonical key: {key}')
+        print(f'Addresses: {group}')
+    print('------------------------')
+
+    # Test for generate the homonyms of a batch of addresses with the same shape
+    print("Test for generate the homonyms of a batch of addresses with the same shape")
+
+    addresses = [f'CRA {street} # {number}A - {building}' for street in range(1, 101)
+                 for number in range(1, 11) for building in range(1, 11)]
+    batch_homonyms = generator.generate_homonyms_batch(addresses)
+    print(f'Addresses: {len(addresses)}, shapes: {len(generator.templates)}')
+    print(f'Same homonyms as one at a time: '
+          f'{all(batch_homonyms[address] == generator.generate_homonyms(address) for address in addresses)}')
+
+    batch_time = min(timeit.repeat(lambda: generator.generate_homonyms_batch(addresses), number=1, repeat=3))
+    single_time = min(timeit.repeat(lambda: [generator.generate_homonyms(address) for address in addresses],
+                                    number=1, repeat=3))
+    print(f'{batch_time * 1e3:.1f} ms in batch and {single_time * 1e3:.1f} ms one at a time')
+    print('------------------------')
+
     # Export the homonyms to a CSV file
     print("Export the homonyms to a CSV file")
 
@@ -0,0 +1,139 @@
+import os
+import time
+
+from sqlite_cache import SQLiteCache
+
+
+class GeocodeCache(SQLiteCache):
+    """
+    A cache of the coordinates of geocoded addresses.
+
+    The coordinates are kept in an SQLite file, so the same addresses are not geocoded again in
+    the next runs. The queries without results are also cached (negative cache), usually for a
+    shorter time, as the map data may be updated. The entries older than their time to live are
+    ignored and queried again.
+    """
+
+    def __init__(self, file_path, ttl=30 * 24 * 3600, negative_ttl=24 * 3600):
+        """
+        Initializes the GeocodeCache object.
+
+        Args:
+            file_path (str): The path to the SQLite file.
+            ttl (float): The number of seconds the coordinates of an address are valid.
+            negative_ttl (float): The number of seconds an address without results is not queried again.
+        """
+        super().__init__(file_path)
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+
+        self.hits = 0
+        self.negative_hits = 0
+        self.expired = 0
+        self.misses = 0
+
+    @staticmethod
+    def get_key(query):
+        """
+        Returns the key of a geocoding query, ignoring the case and the repeated spaces.
+
+        Args:
+            query (str): The query, i.e. the address with the city and the country.
+
+        Returns:
+            str: The normalized query.
+        """
+        return ' '.join(query.split()).casefold()
+
+    def create_tables(self, connection):
+        """
+        Creates the table of the coordinates, if it does not exist.
+
+        Args:
+            connection (sqlite3.Connection): The new connection to the SQLite file.
+        """
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS coordinates ('
+            'query TEXT NOT NULL PRIMARY KEY, latitude REAL, longitude REAL, created REAL NOT NULL)')
+
+    def get(self, query):
+        """
+        Returns the cached coordinates of a query.
+
+        Args:
+            query (str): The query, i.e. the address with the city and the country.
+
+        Returns:
+            tuple: The latitude and longitude, (None, None) if the query is cached without results, or
+                None if the query is not cached or its entry expired.
+        """
+        row = self.get_connection().execute(
+            'SELECT latitude, longitude, created FROM coordinates WHERE query = ?', (self.get_key(query),)).fetchone()
+
+        if row is None:
+            self.misses += 1
+            return None
+
+        latitude, longitude, created = row
+        ttl = self.negative_ttl if latitude is None else self.ttl
+        if time.time() - created > ttl:
+            self.expired += 1
+            return None
+
+        if latitude is None:
+            self.negative_hits += 1
+        else:
+            self.hits += 1
+        return latitude, longitude
+
+    def put(self, query, coordinates):
+        """
+        Caches the coordinates of a query.
+
+        Args:
+            query (str): The query, i.e. the address with the city and the country.
+            coordinates (tuple): The latitude and longitude, or None if the query has no results.
+        """
+        latitude, longitude = coordinates if coordinates is not None else (None, None)
+
+        with self.get_connection() as connection:
+            connection.execute('INSERT OR REPLACE INTO coordinates VALUES (?, ?, ?, ?)',
+                               (self.get_key(query), latitude, longitude, time.time()))
+
+    def get_stats(self):
+        """
+        Returns the counters of the cache.
+
+        Returns:
+            dict: The hits, negative hits, expired entries, misses and hit rate.
+        """
+        lookups = self.hits + self.negative_hits + self.expired + self.misses
+        return {
+            'hits': self.hits,
+            'negative_hits': self.negative_hits,
+            'expired': self.expired,
+            'misses': self.misses,
+            'hit_rate': (self.hits + self.negative_hits) / lookups if lookups else 0.0,
+        }
+
+
+if __name__ == "__main__":
+    import tempfile
+
+    # Test the cache of coordinates
+    print("Test the cache of coordinates")
+
+    file_path = os.path.join(tempfile.mkdtemp(), 'geocode_cache.sqlite')
+    cache = GeocodeCache(file_path, negative_ttl=0.1)
+
+    cache.put("Cra. 57a #62 92, Medellin, Colombia", (6.2655, -75.5657))
+    cache.put("Calle Falsa 123, Medellin, Colombia", None)
+    print("Coordinates: {}".format(cache.get("CRA. 57a  #62 92, Medellin, Colombia")))
+    print("Coordinates of an address without results: {}".format(cache.get("Calle Falsa 123, Medellin, Colombia")))
+    print("Coordinates of an address not cached: {}".format(cache.get("Cl. 43a #1 50, Medellin, Colombia")))
+
+    time.sleep(0.2)
+    print("Coordinates of an address without results, expired: {}".format(
+        cache.get("Calle Falsa 123, Medellin, Colombia")))
+    print("Stats: {}".format(cache.get_stats()))
+    cache.close()
@@ -0,0 +1,260 @@
+import mmap
+import os
+import struct
+
+
+class HomonymStore:
+    """
+    A keyed binary store of the homonyms of each original address.
+
+    The homonyms are appended to a data file, one record per address, and the position of each
+    record is appended to an index file. Opening the store only reads the index, the records are
+    read from a memory map of the data file when an address is looked up, so the homonyms of
+    the rest of the addresses are never parsed.
+
+    The index starts with the version of the generator of the homonyms. A store written by another
+    version, or with another format, is discarded when it is opened, and its files are overwritten
+    by the next append, so changing the replacement rules never returns stale homonyms.
+
+    Index header: length of the version (uint32), followed by the format and the version encoded in UTF-8.
+    Data record: homonyms encoded in UTF-8, each one followed by a new line.
+    Index entry: length of the address (uint32), offset (uint64) and length (uint32) of the
+    record, followed by the address encoded in UTF-8.
+    """
+
+    format_version = '2'
+    index_header = struct.Struct('<I')
+    index_entry = struct.Struct('<IQI')
+
+    def __init__(self, file_path, version):
+        """
+        Initializes the HomonymStore object, reading the index of the file if it exists.
+
+        Args:
+            file_path (str): The path to the data file. The index is stored next to it, with the extension .idx.
+            version (str): The version of the generator, e.g. HomonymsGenerator.get_rules_hash. A store
+                written by another version is discarded.
+        """
+        self.file_path = file_path
+        self.index_path = file_path + '.idx'
+        self.version = version
+
+        header_version = f'{self.format_version}/{version}'.encode('utf-8')
+        self.header = self.index_header.pack(len(header_version)) + header_version
+
+        # True if the files were written by another version, and their homonyms are ignored
+        self.discarded = False
+
+        # Offset and length of the record of each address
+        self.records = {}
+        self.data_size = 0
+        self.index_size = 0
+
+        self.data_map = None
+        self.data_map_size = 0
+
+        if os.path.exists(self.file_path) and os.path.exists(self.index_path):
+            self.read_index()
+
+    def __len__(self):
+        return len(self.records)
+
+    def __contains__(self, address):
+        return address in self.records
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def read_index(self):
+        """
+        Reads the index file. An entry cut by an interrupted write, or pointing past the end of the
+        data file, is ignored, and the next append overwrites it. An index of another version is
+        ignored, and the next append overwrites both files.
+        """
+        with open(self.index_path, 'rb') as file:
+            index = file.read()
+
+        if not index.startswith(self.header):
+            self.discarded = True
+            return
+
+        self.data_size = os.path.getsize(self.file_path)
+
+        position = len(self.header)
+        valid_size = position
+        while position + self.index_entry.size <= len(index):
+            address_length, offset, length = self.index_entry.unpack_from(index, position)
+            end = position + self.index_entry.size + address_length
+            if end > len(index) or offset + length > self.data_size:
+                break
+
+            address = index[position + self.index_entry.size:end].decode('utf-8')
+
+            # A later entry of the same address replaces the earlier one
+            self.records[address] = (offset, length)
+            position = valid_size = end
+
+        self.index_size = valid_size
+        self.data_size = max((offset + length for offset, length in self.records.values()), default=0)
+
+    def get(self, address):
+        """
+        Returns the homonyms of an address.
+
+        Args:
+            address (str): The original address.
+
+        Returns:
+            list: The homonyms of the address, or None if the address is not in the store.
+        """
+        if address not in self.records:
+            return None
+
+        offset, length = self.records[address]
+        if length == 0:
+            return []
+
+        # The file grows with the appends, so it is mapped again when a record is past the end of the map
+        if self.data_map is None or offset + length > self.data_map_size:
+            self.close()
+            with open(self.file_path, 'rb') as file:
+                self.data_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.data_map_size = len(self.data_map)
+
+        # Each homonym ends with a new line, so an empty homonym is kept
+        return self.data_map[offset:offset + length].decode('utf-8').split('\n')[:-1]
+
+    def add(self, address, homonyms):
+        """
+        Appends the homonyms of an address to the store.
+
+        Args:
+            address (str): The original address.
+            homonyms (list): The homonyms of the address. They cannot contain new lines.
+        """
+        self.update({address: homonyms})
+
+    def update(self, homonyms):
+        """
+        Appends the homonyms of several addresses to the store, with a single write to each file.
+        An address already in the store is replaced.
+
+        Args:
+            homonyms (dict): The homonyms of each original address. They cannot contain new lines.
+        """
+        if not homonyms:
+            return
+
+        data = []
+        # A new index, or one written by another version, starts with the header
+        index = [] if self.index_size else [self.header]
+        offset = self.data_size
+        records = {}
+        for address, address_homonyms in homonyms.items():
+            record = ''.join(homonym + '\n' for homonym in address_homonyms).encode('utf-8')
+            key = address.encode('utf-8')
+
+            data.append(record)
+            index.append(self.index_entry.pack(len(key), offset, len(record)) + key)
+            records[address] = (offset, len(record))
+            offset += len(record)
+
+        # The map is not valid while the file is written, it is opened again by the next lookup
+        self.close()
+
+        # The data is written before the index, so an interrupted write never leaves an entry without its record
+        with open(self.file_path, 'r+b' if os.path.exists(self.file_path) else 'wb') as file:
+            file.seek(self.data_size)
+            file.write(b''.join(data))
+            file.truncate()
+
+        with open(self.index_path, 'r+b' if os.path.exists(self.index_path) else 'wb') as file:
+            file.seek(self.index_size)
+            file.write(b''.join(index))
+            file.truncate()
+            self.index_size = file.tell()
+
+        self.records.update(records)
+        self.data_size = offset
+
+    def close(self):
+        """
+        Closes the memory map of the data file.
+        """
+        if self.data_map is not None:
+            self.data_map.close()
+        self.data_map = None
+        self.data_map_size = 0
+
+
+if __name__ == "__main__":
+    from generate_homonyms import HomonymsGenerator
+    import tempfile
+    import timeit
+
+    # Test the store of homonyms
+    print("Test the store of homonyms")
+
+    generator = HomonymsGenerator()
+    addresses = ["Carrera 78A No 47-15", "CRA 70 # 26A - 33", "Cl. 30 # 43 - 17"]
+    file_path = os.path.join(tempfile.mkdtemp(), 'homonyms.bin')
+
+    store = HomonymStore(file_path, generator.get_rules_hash())
+    store.update(generator.generate_homonyms_batch(addresses))
+    print("Addresses in the store: {}".format(len(store)))
+    print("Homonyms of {}: {}".format(addresses[1], store.get(addresses[1])))
+    store.close()
+    print("\n")
+
+    # Test appending addresses to a store written in a previous run
+    print("Test appending addresses to a store written in a previous run")
+
+    store = HomonymStore(file_path, generator.get_rules_hash())
+    store.add("Calle 43A Numero 1 - 50", generator.generate_homonyms("Calle 43A Numero 1 - 50"))
+    store.add("Empty homonym", [""])
+    store.close()
+
+    store = HomonymStore(file_path, generator.get_rules_hash())
+    addresses.append("Calle 43A Numero 1 - 50")
+    print("Addresses in the store: {}".format(len(store)))
+    print("Same homonyms as the generator: {}".format(
+        all(store.get(address) == generator.generate_homonyms(address) for address in addresses)))
+    print("Homonyms of an address with an empty homonym: {}".format(store.get("Empty homonym")))
+    store.close()
+    print("\n")
+
+    # Test a store written with other replacement rules
+    print("Test a store written with other replacement rules")
+
+    generator.word_replacements['#'].append('No')
+    generator.build_index()
+
+    store = HomonymStore(file_path, generator.get_rules_hash())
+    print("Discarded: {}, addresses in the store: {}".format(store.discarded, len(store)))
+    store.update(generator.generate_homonyms_batch(addresses))
+    store.close()
+
+    store = HomonymStore(file_path, generator.get_rules_hash())
+    print("Addresses in the store after the update: {}, same homonyms as the generator: {}".format(
+        len(store), all(store.get(address) == generator.generate_homonyms(address) for address in addresses)))
+    store.close()
+    print("\n")
+
+    # Benchmark the lookup of one address in a large store against reading the whole CSV file
+    print("Benchmark the lookup of one address in a large store against reading the whole CSV file")
+
+    addresses = ['CRA {} # {}A - {}'.format(street, number, building) for street in range(1, 101)
+                 for number in range(1, 11) for building in range(1, 11)]
+    homonyms = generator.generate_homonyms_batch(addresses)
+
+    store = HomonymStore(os.path.join(tempfile.mkdtemp(), 'homonyms.bin'), generator.get_rules_hash())
+    store.update(homonyms)
+    store.close()
+    csv_path = os.path.join(tempfile.mkdtemp(), 'homonyms.csv')
+    generator.export_csv(homonyms, csv_path)
+
+    address = addresses[len(addresses) // 2]
+    store_time = min(timeit.repeat(lambda: HomonymStore(store.file_path, store.version).get(address), number=1, repeat=3))
+    csv_time = min(timeit.repeat(lambda: generator.read_csv(csv_path), number=1, repeat=3))
+    print("{} addresses: {:.1f} ms opening the store and looking up one address, {:.1f} ms reading the CSV file".format(
+        len(addresses), store_time * 1e3, csv_time * 1e3))
@@ -1,5 +1,6 @@
 """
-Run this file to start the program.
+Run this file to start the program. Run it with the --pipeline option to stream the documents
+from AWS S3 straight into the extraction of the addresses, without downloading them to disk.
 
 author: Valentina Castaño Aguirre
 """
@@ -7,8 +8,13 @@ author: Valentina Castaño Aguirre
 # Import the modules
 from upload_documents_aws import DocumentProcessor
 from extract_address import AddressExtractor
+from extraction_cache import ExtractionCache
+from pipeline import ExtractionPipeline
 from generate_homonyms import HomonymsGenerator
+from homonym_store import HomonymStore
 from compute_similarity import AddressSimilarity
+from similarity_cache import SimilarityCache
+from geocode_cache import GeocodeCache
 import query_coordinates as qc
 import draw_map as dm
 
@@ -17,6 +23,7 @@ import glob
 import numpy as np
 import os
 import re
+import sys
 
 def export_array_to_csv(array, filename):
         """
@@ -37,8 +44,12 @@ with open("../api/keys.txt", "r") as f:
         # Close the file
         f.close()
 
-def main():
+def main(use_pipeline=False):
     '''
+    Args:
+        use_pipeline (bool): If True, the documents are streamed from AWS S3 into the extraction of the
+            addresses (phases 1 and 2 overlap) instead of being downloaded to the data folder first.
+
     1) First step.
     Upload n documents to AWS S3 bucket.
     We can upload the documents directly using the AWS S3 console, but as we
@@ -70,9 +81,22 @@ def main():
     # If we want to upload documents to S3, uncomment the following lines
     # file_paths = ["Doc 1.pdf", "Doc 2.pdf"]
     # document_processor.upload_documents_to_s3(file_paths)
-
-    # Download documents from S3
-    document_processor.download_documents_from_s3()
+    # or, for large batches, several files at a time and in parts:
+    # document_processor.upload_documents_to_s3_parallel(file_paths)
+
+    if use_pipeline:
+        # The documents are read from S3 in the second step, while the previous ones are parsed
+        print("The documents are streamed from S3 into the extraction of the addresses")
+    else:
+        # Download from S3 only the documents that are new or changed since the previous run, several
+        # files at a time. The documents that did not change are also skipped by the extraction cache.
+        changed_keys = document_processor.sync_documents_from_s3()
+        print(f"{len(changed_keys)} new or changed documents downloaded from S3: {changed_keys}")
+
+        # The documents that could not be downloaded are tried again in the next run
+        for key, error in document_processor.errors.items():
+            print(f"Document: {key}")
+            print(f"Error: {error}")
 
     '''
     2) Second step.
@@ -90,7 +114,8 @@ def main():
         but in other cases we can use a regular expression (regex) to extract it.
 
         - If a new type of document is added which has a (very) different structure, the only thing
-        to do is to add a new method to the AddressExtractor class with the corresponding logic.
+        to do is to register it with AddressExtractor.register_kind, giving a classifier that recognizes
+        the text of its first page and a function with the logic to locate the address.
 
         - We use the PyPDF2 library to extract the text from the documents. If you don't have PyPDF2
         installed, run the following command:
@@ -101,33 +126,44 @@ def main():
     print("PHASE 2: EXTRACT THE ADDRESS FROM THE DOCUMENTS")
     print(" -- Extracting the address from the documents -- \n")
 
-    # Get all the documents in the data folder using the glob module
-    document_names = glob.glob("../data/*.pdf")
+    # The addresses of the documents that did not change since the previous run are read from
+    # the cache, without parsing the PDFs again.
+    extraction_cache = ExtractionCache(os.path.join('../data/', 'extraction_cache.sqlite'), AddressExtractor.version)
 
-    # If the name of the document contains the word "fidu", it is a fiduciary document,
-    # if contains the word "cons", it is a consolidated document. Otherwise, the default
-    # type of document is consolidated.
-    documents = {}
+    if use_pipeline:
+        # The documents are read from S3 and parsed in parallel processes at the same time
+        pipeline = ExtractionPipeline(document_processor, cache=extraction_cache)
+        dict_addresses = pipeline.run()
+        errors = pipeline.errors
+    else:
+        # Get all the documents in the data folder, including its subfolders, as the downloads keep
+        # the folders of the S3 keys
+        document_names = glob.glob("../data/**/*.pdf", recursive=True)
 
-    for document_name in document_names:
-        if "fidu" in document_name.lower():
-            documents[document_name] = "fiduciary"
-        elif "cons" in document_name.lower():
-            documents[document_name] = "consolidated"
-        else:
-            documents[document_name] = "consolidated"
+        # The type of each document is identified from the text of its first page by the classifiers
+        # registered in AddressExtractor, so the name of the file does not matter.
+        documents = {document_name: None for document_name in document_names}
 
-    # Create an AddressExtractor object
-    extractor = AddressExtractor(documents)
+        # Create an AddressExtractor object
+        extractor = AddressExtractor(documents, cache=extraction_cache)
 
-    # Extract the addresses from the documents
-    dict_addresses = extractor.locate_addresses()
+        # Extract the addresses from the documents. The PDFs are parsed in parallel processes, and a
+        # document that cannot be processed is reported without stopping the rest of the batch.
+        dict_addresses = extractor.locate_addresses_parallel()
+        errors = extractor.errors
 
     for file, address in dict_addresses.items():
         print(f"Document: {file}")
         print(f"Address: {address}")
         print("\n")
 
+    for file, error in errors.items():
+        print(f"Document: {file}")
+        print(f"Error: {error}")
+        print("\n")
+
+    extraction_cache.close()
+
     addresses = dict_addresses.values()
 
     '''
@@ -152,19 +188,29 @@ def main():
     # Create a HomonymsGenerator object
     generator = HomonymsGenerator()
 
-    # Generate the homonyms
-    homonyms = {}
+    # Addresses written with equivalent words (e.g. "CRA 70 # 26A - 33" and "Carrera 70 Nro 26A 33")
+    # have the same canonical key, so exact duplicates are dropped with a hash lookup and only
+    # one address of each group goes to the homonyms generation and similarity phases.
+    groups = generator.group_by_canonical_key(addresses)
+    addresses = [group[0] for group in groups.values()]
 
-    for address in addresses:
-        homonyms[address] = generator.generate_homonyms(address)
+    for key, group in groups.items():
+        if len(group) > 1:
+            print(f"Duplicated addresses {group} kept as: {group[0]}")
 
-    print("Homonyms generated: \n")
-    print(homonyms)
+    # The homonyms are kept in a keyed store, so only the addresses not seen in previous runs
+    # are generated and appended to it. A store written with other replacement rules is discarded.
+    file_path = os.path.join('../data/', 'homonyms.bin')  # Construct the absolute file path
+    store = HomonymStore(file_path, generator.get_rules_hash())
 
-    # Export the homonyms to a csv file
-    file_path = os.path.join('../data/', 'homonyms.csv')  # Construct the absolute file path
+    # Generate the homonyms. Most addresses have the same shape (e.g. "CRA 70 # 26A - 33"), so the
+    # combinations of replacements are built once per shape and only the numbers are filled in.
+    new_addresses = [address for address in addresses if address not in store]
+    homonyms = generator.generate_homonyms_batch(new_addresses)
+    store.update(homonyms)
 
-    generator.export_csv(homonyms, file_path)  # Export the CSV file
+    print(f"Homonyms generated for {len(new_addresses)} new addresses, {len(store)} addresses in the store: \n")
+    print(homonyms)
 
     '''
     4) Fourth step.
@@ -192,36 +238,32 @@ def main():
     print("PHASE 4: COMPUTE THE SIMILARITY BETWEEN THE ADDRESSES")
     print(" -- Computing the similarity between the addresses -- \n")
 
-    # Read the homonyms from the csv file
-    folder_path = os.path.expanduser('../data/')  # Get the absolute path of the folder
-    file_path = os.path.join(folder_path, 'homonyms.csv')  # Construct the absolute file path
+    # Look up the homonyms of each address in the store, without reading the rest of the addresses
+    homonyms = {address: store.get(address) for address in addresses}
+    store.close()
 
-    homonyms_list = generator.read_csv(file_path)
-    # Create a dictionary with the addresses and their homonyms to associate them
-    homonyms = {}
-    
-    i = 0
-    for address in addresses:
-        homonyms[address] = homonyms_list[i]
-        i = i + 1
-
-
-    # Compute the similarity between the addresses and their homonyms for each document
+    # Compute the similarity between the addresses and their homonyms for each document.
+    # The homonyms that cannot reach the threshold are rejected without computing their full distance.
+    # The scores are cached on disk, as the same clients come back in every run.
+    threshold = 0.9
     scores = {}
+    cache = SimilarityCache(os.path.join('../data/', 'similarity_cache.sqlite'))
 
     for address in addresses:
-        similarity = AddressSimilarity(address, homonyms[address])
-        score = similarity.get_all_scores()
+        similarity = AddressSimilarity(address, homonyms[address], cache=cache)
+        score = similarity.get_all_scores(threshold)
 
         scores[address] = score
 
+    cache.close()
+    print(f"Similarity cache: {cache.get_stats()}")
+
 
      # Scores is a dictionary of dictionaries with the similarity scores for each original address
-     # scores -> { original_address_1: { original_address_1: 1, homonym_1: 0.8, homonym_2: 0.6, ... },
-     #             original_address_2: { original_address_2: 1, homonym_1: 0.8, homonym_2: 0.6, ... }}
+     # scores -> { original_address_1: { original_address_1: 1, homonym_1: 0.95, homonym_2: 0.92, ... },
+     #             original_address_2: { original_address_2: 1, homonym_1: 0.95, homonym_2: 0.91, ... }}
 
     # Filter the scores to only keep > 0.9 similarity
-    threshold = 0.9
     for address, score in scores.items():
         scores[address] = {k: v for k, v in score.items() if v > threshold}
 
@@ -255,8 +297,15 @@ def main():
     print("PHASE 5: GET THE COORDINATES OF THE ADDRESSES")
     print(" -- Getting the coordinates of the addresses -- \n")
 
-    # Get the coordinates of the addresses
-    coordinates = qc.get_multiple_coordinates(addresses)
+    # Get the coordinates of the addresses. The coordinates are cached on disk, so the addresses
+    # geocoded in previous runs (also the ones without results) are not queried again.
+    geocode_cache = GeocodeCache(os.path.join('../data/', 'geocode_cache.sqlite'))
+    geocoder = qc.Geocoder(cache=geocode_cache)
+    coordinates = qc.get_multiple_coordinates(addresses, geocoder)
+
+    geocoder.close()
+    geocode_cache.close()
+    print(f"Geocode cache: {geocode_cache.get_stats()}, API calls: {geocoder.api_calls}")
 
     print("Coordinates: \n")
     print(coordinates)
@@ -301,4 +350,4 @@ def main():
     print("HTML document with Google Map generated successfully.")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main(use_pipeline="--pipeline" in sys.argv[1:])
\ No newline at end of file
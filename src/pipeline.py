@@ -0,0 +1,288 @@
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from extract_address import init_extraction_worker, locate_document_address
+import asyncio
+import os
+
+
+class ExtractionPipeline:
+    """
+    Streams the documents of a storage straight into the extraction of their addresses.
+
+    The documents are listed, read and parsed by three stages connected by bounded queues:
+        1. The listing of the documents, in a thread.
+        2. max_downloads tasks that read the content of the documents, in threads.
+        3. max_workers tasks that locate the addresses, in a pool of processes.
+    The network and the CPU work at the same time, and a stage waits when the queue of the next one
+    is full, so only a bounded number of documents is held in memory.
+    """
+
+    def __init__(self, document_processor, max_downloads=8, max_workers=None, queue_size=16, cache=None):
+        """
+        Initializes the ExtractionPipeline object.
+
+        Args:
+            document_processor (DocumentProcessor): The processor of the storage with the documents.
+            max_downloads (int): The number of documents read at the same time.
+            max_workers (int, optional): The number of processes that parse the documents. If None, the number of CPUs.
+            queue_size (int): The maximum number of documents waiting between two stages.
+            cache (ExtractionCache, optional): A cache of the addresses extracted from documents with the same content.
+        """
+        self.document_processor = document_processor
+        self.max_downloads = max_downloads
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.queue_size = queue_size
+        self.cache = cache
+
+        # Errors of the documents that could not be read or processed by the last run
+        self.errors = {}
+
+    def read_document(self, object_name):
+        """
+        Reads the content of a document of the storage.
+
+        Args:
+            object_name (str): The key of the document.
+
+        Returns:
+            bytes: The content of the document.
+        """
+        stream = self.document_processor.get_document_stream(object_name)
+        try:
+            return stream.read()
+        finally:
+            stream.close()
+
+    async def list_documents(self, prefix, keys, io_executor):
+        """
+        Puts the keys of the documents into the queue of keys, followed by one None per reading task
+        when the listing ends.
+
+        Args:
+            prefix (str): Only the documents whose keys start with this prefix are listed.
+            keys (asyncio.Queue): The queue of keys.
+            io_executor (ThreadPoolExecutor): The threads for the blocking calls to the storage.
+
+        Returns:
+            list: The keys in the order of the listing.
+        """
+        loop = asyncio.get_running_loop()
+        documents = self.document_processor.list_documents(prefix)
+        listed = []
+
+        while True:
+            # The listing asks the storage for the next page as needed, so it runs in a thread
+            document = await loop.run_in_executor(io_executor, next, documents, None)
+            if document is None:
+                break
+
+            listed.append(document["Key"])
+            await keys.put(document["Key"])
+
+        for _ in range(self.max_downloads):
+            await keys.put(None)
+
+        return listed
+
+    async def read_documents(self, keys, contents, io_executor):
+        """
+        Reads the documents of the queue of keys into the queue of contents, until a None key.
+
+        Args:
+            keys (asyncio.Queue): The queue of keys.
+            contents (asyncio.Queue): The queue of tuples (key, content).
+            io_executor (ThreadPoolExecutor): The threads for the blocking calls to the storage.
+        """
+        loop = asyncio.get_running_loop()
+
+        while True:
+            object_name = await keys.get()
+            if object_name is None:
+                return
+
+            try:
+                content = await loop.run_in_executor(io_executor, self.read_document, object_name)
+            except Exception as error:
+                self.errors[object_name] = f'{type(error).__name__}: {error}'
+                continue
+
+            await contents.put((object_name, content))
+
+    async def stream_documents(self, prefix, keys, contents, io_executor):
+        """
+        Lists and reads the documents of the storage into the queue of contents, followed by one None
+        per extraction task.
+
+        Args:
+            prefix (str): Only the documents whose keys start with this prefix are listed.
+            keys (asyncio.Queue): The queue of keys.
+            contents (asyncio.Queue): The queue of tuples (key, content).
+            io_executor (ThreadPoolExecutor): The threads for the blocking calls to the storage.
+
+        Returns:
+            list: The keys in the order of the listing.
+        """
+        readers = [asyncio.create_task(self.read_documents(keys, contents, io_executor))
+                   for _ in range(self.max_downloads)]
+
+        try:
+            listed = await self.list_documents(prefix, keys, io_executor)
+            await asyncio.gather(*readers)
+        finally:
+            # Nothing reads the queue of keys after a failure of the listing
+            for reader in readers:
+                reader.cancel()
+
+        for _ in range(self.max_workers):
+            await contents.put(None)
+
+        return listed
+
+    async def extract_addresses(self, contents, addresses, cpu_executor):
+        """
+        Locates the addresses of the documents of the queue of contents, until a None entry.
+
+        Args:
+            contents (asyncio.Queue): The queue of tuples (key, content).
+            addresses (dict): The dictionary where the address of each key is stored.
+            cpu_executor (ProcessPoolExecutor): The processes that parse the documents.
+        """
+        loop = asyncio.get_running_loop()
+
+        while True:
+            entry = await contents.get()
+            if entry is None:
+                return
+
+            # The type of each document is identified from its first page
+            object_name, content = entry
+            try:
+                address, error, cache_lookups = await loop.run_in_executor(
+                    cpu_executor, locate_document_address, (content, None))
+            except Exception as exception:
+                # A worker process that dies breaks the pool, and the rest of the documents fail the same way
+                self.errors[object_name] = f'{type(exception).__name__}: {exception}'
+                continue
+
+            if error is None:
+                addresses[object_name] = address
+            else:
+                self.errors[object_name] = error
+
+            if self.cache is not None:
+                self.cache.add_lookups(*cache_lookups)
+
+    async def run_async(self, prefix=""):
+        """
+        Locates the addresses of the documents of the storage.
+
+        Args:
+            prefix (str): Only the documents whose keys start with this prefix are processed.
+
+        Returns:
+            dict: The address of each key, in the order of the listing. The documents with errors are
+                not included, their errors are kept in self.errors.
+        """
+        self.errors = {}
+        addresses = {}
+
+        keys = asyncio.Queue(self.queue_size)
+        contents = asyncio.Queue(self.queue_size)
+
+        with ThreadPoolExecutor(max_workers=self.max_downloads + 1) as io_executor, \
+                ProcessPoolExecutor(max_workers=self.max_workers, initializer=init_extraction_worker,
+                                    initargs=(self.cache,)) as cpu_executor:
+
+            streamer = asyncio.create_task(self.stream_documents(prefix, keys, contents, io_executor))
+            extractors = [asyncio.create_task(self.extract_addresses(contents, addresses, cpu_executor))
+                          for _ in range(self.max_workers)]
+            tasks = [streamer, *extractors]
+
+            # A stage that fails would leave the others waiting on a full or empty queue, so the
+            # first failure cancels all the tasks and is raised
+            try:
+                done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
+                for task in done:
+                    task.result()
+            finally:
+                for task in tasks:
+                    task.cancel()
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+        listed = streamer.result()
+        return {object_name: addresses[object_name] for object_name in listed if object_name in addresses}
+
+    def run(self, prefix=""):
+        """
+        Locates the addresses of the documents of the storage, from synchronous code (see run_async).
+
+        Args:
+            prefix (str): Only the documents whose keys start with this prefix are processed.
+
+        Returns:
+            dict: The address of each key, in the order of the listing.
+        """
+        return asyncio.run(self.run_async(prefix))
+
+
+if __name__ == "__main__":
+    from extract_address import AddressExtractor
+    from storage_backends import LocalBackend
+    from upload_documents_aws import DocumentProcessor
+    import shutil
+    import tempfile
+    import timeit
+
+    # Test the pipeline on a local folder with many documents
+    print("Test the pipeline on a local folder with many documents")
+
+    backend = LocalBackend(tempfile.mkdtemp())
+    for i in range(50):
+        backend.put("statements/{:03d} CONS.pdf".format(i), "Doc 1.pdf")
+        backend.put("statements/{:03d} FIDU.pdf".format(i), "Doc 2.pdf")
+    shutil.copyfile("Doc 1.pdf", os.path.join(backend.root, "statements", "broken.pdf"))
+    with open(os.path.join(backend.root, "statements", "broken.pdf"), "r+b") as file:
+        file.truncate(1000)
+
+    document_processor = DocumentProcessor(backend=backend)
+    pipeline = ExtractionPipeline(document_processor, max_downloads=4, queue_size=8)
+    addresses = pipeline.run("statements/")
+    print("Addresses: {}, distinct: {}, errors: {}".format(
+        len(addresses), sorted(set(addresses.values())), pipeline.errors))
+    print("\n")
+
+    # Test a pipeline whose storage fails in the middle of the listing
+    print("Test a pipeline whose storage fails in the middle of the listing")
+
+    class FailingProcessor(DocumentProcessor):
+        def list_documents(self, prefix=""):
+            for i, document in enumerate(super().list_documents(prefix)):
+                if i == 60:
+                    raise ConnectionError("The listing was interrupted")
+                yield document
+
+    try:
+        ExtractionPipeline(FailingProcessor(backend=backend), max_downloads=4, queue_size=2).run("statements/")
+    except ConnectionError as error:
+        print("Error raised without waiting for the other stages: {}".format(error))
+    print("\n")
+
+    # Benchmark the pipeline against reading all the documents first and then extracting the addresses
+    print("Benchmark the pipeline against reading all the documents first and then extracting the addresses")
+
+    def extract_sequentially():
+        contents = {document["Key"]: pipeline.read_document(document["Key"])
+                    for document in document_processor.list_documents("statements/")}
+        extractor = AddressExtractor({})
+        addresses = {}
+        for object_name, content in contents.items():
+            try:
+                addresses[object_name] = extractor.locate_address(content)
+            except Exception:
+                pass
+        return addresses
+
+    pipeline_time = min(timeit.repeat(lambda: pipeline.run("statements/"), number=1, repeat=3))
+    sequential_time = min(timeit.repeat(extract_sequentially, number=1, repeat=3))
+    print("Same addresses: {}".format(pipeline.run("statements/") == extract_sequentially()))
+    print("{:.0f} documents/s with the pipeline and {:.0f} documents/s sequentially".format(
+        len(addresses) / pipeline_time, len(addresses) / sequential_time))
@@ -1,6 +1,8 @@
 import googlemaps
 from datetime import datetime
+from requests.adapters import HTTPAdapter
 import re
+import requests
 
 with open("../api/keys.txt", "r") as f:
         # Read the file
@@ -9,7 +11,121 @@ with open("../api/keys.txt", "r") as f:
         # Close the file
         f.close()
 
-def get_coordinates(address):
+class Geocoder:
+    """
+    A geocoder of addresses that keeps a single Google Maps client, so all the queries share the
+    same HTTP session and reuse its open connections instead of connecting again each time.
+    """
+
+    def __init__(self, key=None, pool_size=10, requests_per_second=50, base_url="https://maps.googleapis.com",
+                 timeout=None, cache=None):
+        """
+        Parameters
+        ----------
+        key : str, optional
+            The Google Maps API key. By default, the key of the API keys file.
+        pool_size : int
+            The maximum number of connections kept open to the server.
+        requests_per_second : int
+            The maximum number of queries sent per second.
+        base_url : str
+            The URL of the Google Maps API, e.g. the URL of a local stub server for tests.
+        timeout : int, optional
+            The maximum number of seconds of a query, including its retries.
+        cache : GeocodeCache, optional
+            A cache of the coordinates of the addresses, including the addresses without results.
+        """
+        if key is None:
+            key = re.search(r'gmaps = "(.*)"', input_string).group(1)
+
+        # Keep-alive session with a pool of connections to the server
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        # The client waits before a query that would exceed the queries per second
+        self.client = googlemaps.Client(key=key, timeout=timeout, queries_per_second=requests_per_second,
+                                        queries_per_minute=requests_per_second * 60,
+                                        requests_session=self.session, base_url=base_url)
+
+        self.cache = cache
+
+        # Number of queries sent to the API, the rest were answered by the cache
+        self.api_calls = 0
+
+    def get_coordinates(self, address):
+        """
+        Get the latitude and longitude of an address
+
+        Parameters
+        ----------
+        address : str
+            The address to be queried.
+
+        Returns
+        -------
+        latitude : float
+        longitude : float
+        """
+        # Geocoding an address in Medellin, Colombia to improve the accuracy of the results. The
+        # repeated spaces are dropped, so the same address written with other spaces is cached once.
+        query = ' '.join(address.split()) + ', Medellin, Colombia'
+
+        if self.cache is not None:
+            cached = self.cache.get(query)
+            if cached is not None:
+                if cached == (None, None):
+                    print(f'No coordinates found for the address {address} (cached).')
+                    return None
+                return cached
+
+        geocode_result = self.client.geocode(query)
+        self.api_calls += 1
+
+        if geocode_result:
+            # Extract latitude and longitude
+            latitude = geocode_result[0]['geometry']['location']['lat']
+            longitude = geocode_result[0]['geometry']['location']['lng']
+
+            if self.cache is not None:
+                self.cache.put(query, (latitude, longitude))
+
+            return latitude, longitude
+
+        else:
+            # The addresses without results are also cached, so they are not queried again in every run
+            if self.cache is not None:
+                self.cache.put(query, None)
+
+            print(f'No coordinates found for the address {address}.')
+
+    def close(self):
+        """
+        Close the connections of the geocoder
+        """
+        self.session.close()
+
+
+# Geocoder shared by the module functions, created on the first query
+default_geocoder = None
+
+
+def get_default_geocoder():
+    """
+    Get the geocoder shared by the module functions, creating it the first time
+
+    Returns
+    -------
+    geocoder : Geocoder
+    """
+    global default_geocoder
+    if default_geocoder is None:
+        default_geocoder = Geocoder()
+    return default_geocoder
+
+
+def get_coordinates(address, geocoder=None):
     """
     Get the latitude and longitude of an address
 
@@ -17,30 +133,18 @@ def get_coordinates(address):
     ----------
     address : str
         The address to be queried.
+    geocoder : Geocoder, optional
+        The geocoder used for the query. By default, the geocoder shared by the module functions.
 
     Returns
     -------
     latitude : float
     longitude : float
     """
-    gmaps_key = re.search(r'gmaps = "(.*)"', input_string).group(1)
-    gmaps = googlemaps.Client(key=gmaps_key)
-
-    # Geocoding an address in Medellin, Colombia to improve the accuracy of the results
-    geocode_result = gmaps.geocode(address + ', Medellin, Colombia')
+    return (geocoder or get_default_geocoder()).get_coordinates(address)
 
-    if geocode_result:
-        # Extract latitude and longitude
-        latitude = geocode_result[0]['geometry']['location']['lat']
-        longitude = geocode_result[0]['geometry']['location']['lng']
 
-        return latitude, longitude
-
-    else:
-        print(f'No coordinates found for the address {address}.')
-
-
-def get_multiple_coordinates(addresses):
+def get_multiple_coordinates(addresses, geocoder=None):
     """
     Get the latitude and longitude of multiple addresses
 
@@ -48,18 +152,23 @@ def get_multiple_coordinates(addresses):
     ----------
     addresses : list
         A list of addresses to be queried.
+    geocoder : Geocoder, optional
+        The geocoder used for the queries. By default, the geocoder shared by the module functions.
 
     Returns
     -------
     coordinates : dict
-        A dictionary with the addresses as keys and the coordinates as values.
+        A dictionary with the addresses as keys and the coordinates as values. The addresses without
+        coordinates are not included.
     """
+    geocoder = geocoder or get_default_geocoder()
 
-    # Query the coordinates of each address
+    # Query the coordinates of each address, all the queries use the same connections
     coordinates = {}
     for address in addresses:
-        latitude, longitude = get_coordinates(address)
-        coordinates[address] = (latitude, longitude)
+        coordinate = get_coordinates(address, geocoder)
+        if coordinate is not None:
+            coordinates[address] = coordinate
 
     return coordinates
 
@@ -82,5 +191,68 @@ if __name__ == "__main__":
     print("\n")
 
     new_york_coordinates = (40.75, -74.00)
+
+    # Benchmark the latency of the queries against a local stub of the API
+    print("Benchmark the latency of the queries against a local stub of the API")
+
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    import json
+    import threading
+    import timeit
+
+    class StubHandler(BaseHTTPRequestHandler):
+        # HTTP/1.1 keeps the connections open between queries, and the headers and the body are
+        # sent without waiting for the acknowledgement of the client
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True
+
+        def do_GET(self):
+            body = json.dumps({"status": "OK", "results": [{"geometry": {"location": {"lat": 6.25, "lng": -75.56}}}]})
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body.encode())
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = "http://127.0.0.1:{}".format(server.server_port)
+    stub_key = "AIzaStubKey"
+
+    def query_new_client():
+        # A new client, session and connection for each query
+        client = googlemaps.Client(key=stub_key, base_url=base_url)
+        return client.geocode(address + ', Medellin, Colombia')
+
+    geocoder = Geocoder(key=stub_key, base_url=base_url, requests_per_second=1000)
+    n_queries = 200
+    new_client_time = min(timeit.repeat(query_new_client, number=n_queries, repeat=3)) / n_queries
+    geocoder_time = min(timeit.repeat(lambda: geocoder.get_coordinates(address), number=n_queries, repeat=3)) / n_queries
+    print("{:.2f} ms per query with a new client, {:.2f} ms per query with the pooled geocoder".format(
+        new_client_time * 1e3, geocoder_time * 1e3))
+
+    geocoder.close()
+    print("\n")
+
+    # Test the cache of coordinates in repeated runs against the local stub of the API
+    print("Test the cache of coordinates in repeated runs against the local stub of the API")
+
+    from geocode_cache import GeocodeCache
+    import os
+    import tempfile
+
+    cache_path = os.path.join(tempfile.mkdtemp(), 'geocode_cache.sqlite')
+    for run in range(2):
+        cache = GeocodeCache(cache_path)
+        geocoder = Geocoder(key=stub_key, base_url=base_url, cache=cache)
+        coordinates = get_multiple_coordinates(addresses, geocoder)
+        print("Run {}: {} API calls, cache stats {}".format(run + 1, geocoder.api_calls, cache.get_stats()))
+        geocoder.close()
+        cache.close()
+
+    server.shutdown()
     
 
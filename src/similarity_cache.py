@@ -0,0 +1,234 @@
+from collections import OrderedDict
+import os
+
+from sqlite_cache import SQLiteCache
+
+
+class SimilarityCache(SQLiteCache):
+    """
+    A cache of similarity scores between pairs of addresses.
+
+    The scores are kept in an in-memory LRU of limited size, backed by an SQLite file so they
+    survive between runs. Each process opens its own connection to the file, and SQLite handles
+    the locking, so the same cache can be shared by worker processes.
+
+    A pair rejected by a threshold has no exact score, so the largest score it can have is cached
+    instead. It answers the lookups with the same or a higher threshold, and a lower threshold
+    computes the score again.
+    """
+
+    def __init__(self, file_path=None, max_size=100000, flush_every=1000):
+        """
+        Initializes the SimilarityCache object.
+
+        Args:
+            file_path (str, optional): The path to the SQLite file. If None, the cache is only in memory.
+            max_size (int): The maximum number of scores kept in memory.
+            flush_every (int): The number of new scores buffered before writing them to the file.
+        """
+        super().__init__(file_path)
+        self.max_size = max_size
+        self.flush_every = flush_every
+
+        self.entries = OrderedDict()
+        self.pending = {}
+
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def __getstate__(self):
+        # The buffered scores are written by the process that computed them
+        state = super().__getstate__()
+        state['pending'] = {}
+        return state
+
+    @staticmethod
+    def get_key(first_address, second_address):
+        """
+        Returns the key of a pair of addresses. The similarity score is symmetric, so the
+        key does not depend on the order of the addresses.
+
+        Args:
+            first_address (str): The first address.
+            second_address (str): The second address.
+
+        Returns:
+            tuple: The addresses in sorted order.
+        """
+        if first_address <= second_address:
+            return first_address, second_address
+        return second_address, first_address
+
+    def create_tables(self, connection):
+        """
+        Creates the table of the scores, if it does not exist, and adds the columns missing in older files.
+
+        Args:
+            connection (sqlite3.Connection): The new connection to the SQLite file.
+        """
+        connection.execute(
+            'CREATE TABLE IF NOT EXISTS scores ('
+            'first_address TEXT NOT NULL, second_address TEXT NOT NULL, score REAL NOT NULL, '
+            'exact INTEGER NOT NULL DEFAULT 1, '
+            'PRIMARY KEY (first_address, second_address))')
+
+        # The files written before the bounds were cached only have exact scores
+        columns = [row[1] for row in connection.execute('PRAGMA table_info(scores)')]
+        if 'exact' not in columns:
+            connection.execute('ALTER TABLE scores ADD COLUMN exact INTEGER NOT NULL DEFAULT 1')
+
+    def remember(self, key, entry):
+        """
+        Keeps a score in memory, evicting the least recently used scores above the maximum size.
+
+        Args:
+            key (tuple): The key of the pair of addresses.
+            entry (tuple): The similarity score, or its largest value, and whether it is exact.
+        """
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def get(self, first_address, second_address, threshold=None):
+        """
+        Returns the cached similarity score between two addresses.
+
+        Args:
+            first_address (str): The first address.
+            second_address (str): The second address.
+            threshold (float, optional): The threshold of the lookup. The largest score of a rejected pair
+                is only returned if it is below the threshold, i.e. if it rejects the pair again.
+
+        Returns:
+            tuple: The similarity score and True, or the largest score of a pair rejected by a threshold
+                and False, or None if the pair is not cached.
+        """
+        key = self.get_key(first_address, second_address)
+
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            entry, source = self.entries[key], 'memory'
+        elif key in self.pending:
+            # The scores not yet written to the file may have been evicted from the LRU
+            entry, source = self.pending[key], 'memory'
+            self.remember(key, entry)
+        else:
+            entry, source = None, 'disk'
+            connection = self.get_connection()
+            if connection is not None:
+                row = connection.execute(
+                    'SELECT score, exact FROM scores WHERE first_address = ? AND second_address = ?', key).fetchone()
+                if row is not None:
+                    entry = (row[0], bool(row[1]))
+                    self.remember(key, entry)
+
+        # A bound that does not reject the pair with this threshold does not save the computation
+        if entry is not None and not entry[1] and (threshold is None or entry[0] >= threshold):
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+        elif source == 'memory':
+            self.memory_hits += 1
+        else:
+            self.disk_hits += 1
+        return entry
+
+    def put(self, first_address, second_address, score, exact=True):
+        """
+        Caches the similarity score between two addresses.
+
+        Args:
+            first_address (str): The first address.
+            second_address (str): The second address.
+            score (float): The similarity score.
+            exact (bool): False if the score is only the largest score of a pair rejected by a threshold.
+        """
+        key = self.get_key(first_address, second_address)
+        entry = (float(score), exact)
+        self.remember(key, entry)
+
+        if self.file_path is not None:
+            self.pending[key] = entry
+            if len(self.pending) >= self.flush_every:
+                self.flush()
+
+    def flush(self):
+        """
+        Writes the buffered scores to the SQLite file.
+        """
+        connection = self.get_connection()
+        if connection is None or not self.pending:
+            return
+
+        with connection:
+            connection.executemany('INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?)',
+                                   [(*key, score, int(exact)) for key, (score, exact) in self.pending.items()])
+        self.pending = {}
+
+    def close(self):
+        """
+        Writes the buffered scores and closes the connection of the current process.
+        """
+        self.flush()
+        super().close()
+
+    def get_stats(self):
+        """
+        Returns the counters of the cache.
+
+        Returns:
+            dict: The memory hits, disk hits, misses, hit rate and number of scores in memory.
+        """
+        lookups = self.memory_hits + self.disk_hits + self.misses
+        return {
+            'memory_hits': self.memory_hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            'size': len(self.entries),
+        }
+
+
+if __name__ == "__main__":
+    from compute_similarity import AddressSimilarity
+    import tempfile
+
+    # Test the cache of similarity scores
+    print("Test the cache of similarity scores")
+
+    original_address = "Carrera 78A No 47-15"
+    homonyms_address = ["Carrera 78A # 47-15", "Kra 78A Num 47-15", "Cra 78A Nro 47-15"]
+    file_path = os.path.join(tempfile.mkdtemp(), 'similarity_cache.sqlite')
+
+    cache = SimilarityCache(file_path)
+    similarity = AddressSimilarity(original_address, homonyms_address, cache=cache)
+    scores = similarity.get_all_scores()
+    scores = similarity.get_all_scores()
+    print("Scores: {}".format(scores))
+    print("Stats in the first run, scoring twice: {}".format(cache.get_stats()))
+    cache.close()
+    print("\n")
+
+    # Test the cache in a new run, with the scores on disk and the pairs in the other order
+    print("Test the cache in a new run, with the scores on disk and the pairs in the other order")
+
+    cache = SimilarityCache(file_path)
+    for address in homonyms_address:
+        score = cache.get(address, original_address)
+    print("Stats in the second run: {}".format(cache.get_stats()))
+    cache.close()
+    print("\n")
+
+    # Test the cache of the pairs rejected by a threshold in a new run, and with a lower threshold
+    print("Test the cache of the pairs rejected by a threshold in a new run, and with a lower threshold")
+
+    file_path = os.path.join(tempfile.mkdtemp(), 'similarity_cache.sqlite')
+    for threshold in [0.9, 0.9, 0.7]:
+        cache = SimilarityCache(file_path)
+        similarity = AddressSimilarity(original_address, homonyms_address, cache=cache)
+        scores = similarity.get_all_scores(threshold)
+        print("Threshold {}: {} scores, stats {}".format(threshold, len(scores), cache.get_stats()))
+        cache.close()
@@ -0,0 +1,71 @@
+import os
+import sqlite3
+
+
+class SQLiteCache:
+    """
+    The base of the caches kept in an SQLite file.
+
+    Each process opens its own connection to the file, as an SQLite connection cannot be shared
+    between processes, and SQLite handles the locking, so the same cache can be used by worker
+    processes. The subclasses create their tables in create_tables.
+    """
+
+    def __init__(self, file_path):
+        """
+        Initializes the SQLiteCache object.
+
+        Args:
+            file_path (str): The path to the SQLite file, or None for a cache without file.
+        """
+        self.file_path = file_path
+
+        self.connection = None
+        self.connection_pid = None
+
+    def __getstate__(self):
+        # The connection belongs to the process that opened it, the copies open their own
+        state = self.__dict__.copy()
+        state['connection'] = None
+        state['connection_pid'] = None
+        return state
+
+    def create_tables(self, connection):
+        """
+        Creates the tables of the cache, if they do not exist.
+
+        Args:
+            connection (sqlite3.Connection): The new connection to the SQLite file.
+        """
+        raise NotImplementedError
+
+    def get_connection(self):
+        """
+        Returns the connection of the current process to the SQLite file, opening it if needed.
+
+        Returns:
+            sqlite3.Connection: The connection, or None if the cache has no file.
+        """
+        if self.file_path is None:
+            return None
+
+        if self.connection is None or self.connection_pid != os.getpid():
+            self.connection = sqlite3.connect(self.file_path, timeout=30)
+            self.connection_pid = os.getpid()
+
+            # Write-ahead logging lets readers and a writer of different processes work at the same time
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute('PRAGMA synchronous=NORMAL')
+            self.create_tables(self.connection)
+            self.connection.commit()
+
+        return self.connection
+
+    def close(self):
+        """
+        Closes the connection of the current process.
+        """
+        if self.connection is not None and self.connection_pid == os.getpid():
+            self.connection.close()
+        self.connection = None
+        self.connection_pid = None
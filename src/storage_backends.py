@@ -0,0 +1,265 @@
+from abc import ABC, abstractmethod
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+from datetime import datetime, timezone
+import boto3
+import io
+import mmap
+import os
+import shutil
+
+class StorageBackend(ABC):
+    """
+    A storage of documents, where each document is identified by a key.
+
+    The subclasses implement the abstract methods list_documents, get_stream and put. The documents of a backend are
+    listed with the same fields as an S3 listing (Key, Size, ETag and LastModified), so the same
+    code can work with any backend.
+    """
+
+    @abstractmethod
+    def list_documents(self, prefix=""):
+        """
+        List the documents of the storage
+
+        Parameters
+        ----------
+        prefix : str
+            Only the keys starting with this prefix are listed
+
+        Returns
+        -------
+        Iterator[dict]
+            The documents (Key, Size, ETag and LastModified), one at a time
+        """
+
+    @abstractmethod
+    def get_stream(self, key):
+        """
+        Open a document for reading
+
+        Parameters
+        ----------
+        key : str
+            Key of the document
+
+        Returns
+        -------
+        file-like
+            The content of the document. It must be closed when it is no longer needed
+        """
+
+    @abstractmethod
+    def put(self, key, file_path):
+        """
+        Store a file as a document
+
+        Parameters
+        ----------
+        key : str
+            Key of the document
+        file_path : str
+            Path of the file
+        """
+
+    def download(self, key, file_path):
+        """
+        Copy a document to a file
+
+        Parameters
+        ----------
+        key : str
+            Key of the document
+        file_path : str
+            Path of the file
+        """
+        stream = self.get_stream(key)
+        try:
+            with open(file_path, "wb") as file:
+                shutil.copyfileobj(stream, file)
+        finally:
+            stream.close()
+
+
+class S3Backend(StorageBackend):
+    """
+    A storage of documents in an AWS S3 bucket, or in an S3 compatible service.
+    """
+
+    def __init__(self, aws_access_key, aws_secret_key, bucket_name, endpoint_url=None, max_workers=8,
+                 transfer_config=None, upload_transfer_config=None):
+        """
+        Parameters
+        ----------
+        aws_access_key : str
+            AWS access key ID
+        aws_secret_key : str
+            AWS secret access key
+        bucket_name : str
+            AWS S3 bucket name
+        endpoint_url : str, optional
+            URL of an S3 compatible service to use instead of AWS, e.g. a local S3 stand-in for tests
+        max_workers : int
+            Number of files transferred at the same time, to size the connection pool
+        transfer_config : TransferConfig, optional
+            Settings of the download of each file (multipart threshold, concurrency, ...)
+        upload_transfer_config : TransferConfig, optional
+            Settings of the upload of each file. By default, large statement PDFs are uploaded in
+            parts of 16 MB, 4 parts at a time
+        """
+        self.bucket_name = bucket_name
+        self.transfer_config = transfer_config or TransferConfig(max_concurrency=4)
+        self.upload_transfer_config = upload_transfer_config or TransferConfig(
+            multipart_threshold=16 * 1024 * 1024,
+            multipart_chunksize=16 * 1024 * 1024,
+            max_concurrency=4,
+        )
+        max_concurrency = max(self.transfer_config.max_concurrency, self.upload_transfer_config.max_concurrency)
+
+        # Each file can use max_concurrency connections, so the pool must fit all the files in flight
+        self.s3_client = boto3.client(
+            "s3",
+            aws_access_key_id=aws_access_key,
+            aws_secret_access_key=aws_secret_key,
+            endpoint_url=endpoint_url,
+            config=Config(max_pool_connections=max(10, max_workers * max_concurrency)),
+        )
+
+    def list_documents(self, prefix=""):
+        # A single call lists at most 1000 keys, the paginator asks for the next pages as needed
+        paginator = self.s3_client.get_paginator("list_objects_v2")
+
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=prefix):
+            yield from page.get("Contents", [])
+
+    def get_stream(self, key):
+        return self.s3_client.get_object(Bucket=self.bucket_name, Key=key)["Body"]
+
+    def put(self, key, file_path):
+        self.s3_client.upload_file(file_path, self.bucket_name, key, Config=self.upload_transfer_config)
+
+    def download(self, key, file_path):
+        self.s3_client.download_file(self.bucket_name, key, file_path, Config=self.transfer_config)
+
+
+class LocalBackend(StorageBackend):
+    """
+    A storage of documents in a local folder, where the key of a document is its path relative to
+    the folder, with '/' separators.
+
+    The documents are served as memory maps of their files, so reading them does not copy them
+    and the pipeline runs at disk speed, e.g. for benchmarks and offline runs.
+    """
+
+    def __init__(self, root):
+        """
+        Parameters
+        ----------
+        root : str
+            Path of the folder
+        """
+        self.root = root
+
+    def get_path(self, key):
+        """
+        Get the path of the file of a document
+
+        Parameters
+        ----------
+        key : str
+            Key of the document
+
+        Returns
+        -------
+        str
+            Resolved path of the file
+
+        Raises
+        ------
+        ValueError
+            If the key leads outside the folder, e.g. with '..'
+        """
+        root = os.path.realpath(self.root)
+        path = os.path.realpath(os.path.join(root, *key.split("/")))
+
+        if path == root or os.path.commonpath([root, path]) != root:
+            raise ValueError(f"The key '{key}' leads outside the folder of the storage.")
+        return path
+
+    def list_documents(self, prefix=""):
+        folders = [self.root]
+
+        while folders:
+            folder = folders.pop()
+            with os.scandir(folder) as entries:
+                entries = sorted(entries, key=lambda entry: entry.name)
+
+                # The folders are walked in order after the files, the last pushed is the first popped
+                folders.extend(entry.path for entry in reversed(entries) if entry.is_dir())
+
+                for entry in entries:
+                    if entry.is_dir():
+                        continue
+
+                    key = os.path.relpath(entry.path, self.root).replace(os.sep, "/")
+                    if not key.startswith(prefix):
+                        continue
+
+                    # Like the ETag of S3, the tag changes when the file is written again
+                    stat = entry.stat()
+                    yield {
+                        "Key": key,
+                        "Size": stat.st_size,
+                        "ETag": f'"{stat.st_size:x}-{stat.st_mtime_ns:x}"',
+                        "LastModified": datetime.fromtimestamp(stat.st_mtime, timezone.utc),
+                    }
+
+    def get_stream(self, key):
+        with open(self.get_path(key), "rb") as file:
+            # Empty files cannot be mapped
+            if os.fstat(file.fileno()).st_size == 0:
+                return io.BytesIO()
+            return mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def put(self, key, file_path):
+        path = self.get_path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Copy to a temporary file first, so readers never see a partial document
+        temporary_path = path + ".tmp"
+        shutil.copyfile(file_path, temporary_path)
+        os.replace(temporary_path, path)
+
+
+if __name__ == "__main__":
+    from extract_address import AddressExtractor
+    import tempfile
+    import timeit
+
+    # Test the local storage of documents
+    print("Test the local storage of documents")
+
+    backend = LocalBackend(tempfile.mkdtemp())
+    backend.put("statements/Doc 1.pdf", "Doc 1.pdf")
+    backend.put("statements/Doc 2.pdf", "Doc 2.pdf")
+
+    documents = list(backend.list_documents())
+    print("Documents: {}".format([(document["Key"], document["Size"]) for document in documents]))
+    print("\n")
+
+    # Benchmark the extraction of the addresses from the memory maps of the documents
+    print("Benchmark the extraction of the addresses from the memory maps of the documents")
+
+    extractor = AddressExtractor({})
+
+    def extract_addresses():
+        addresses = {}
+        for document in backend.list_documents("statements/"):
+            stream = backend.get_stream(document["Key"])
+            addresses[document["Key"]] = extractor.locate_address(stream)
+            stream.close()
+        return addresses
+
+    print("Addresses: {}".format(extract_addresses()))
+    print("{:.1f} ms per document".format(
+        min(timeit.repeat(extract_addresses, number=1, repeat=3)) / len(documents) * 1e3))
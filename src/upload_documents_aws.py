@@ -1,11 +1,17 @@
-import boto3
+from concurrent.futures import ThreadPoolExecutor
+from storage_backends import S3Backend
+import json
+import os
+import re
+import time
 
 class DocumentProcessor:
     """
-    A class used to upload and download documents from AWS S3
+    A class used to upload and download documents from AWS S3, or from another storage backend
     
     """
-    def __init__(self, aws_access_key, aws_secret_key, bucket_name):
+    def __init__(self, aws_access_key=None, aws_secret_key=None, bucket_name=None, endpoint_url=None, max_workers=8,
+                 transfer_config=None, upload_transfer_config=None, backend=None):
         """
         Parameters
         ----------
@@ -15,15 +21,36 @@ class DocumentProcessor:
             AWS secret access key
         bucket_name : str
             AWS S3 bucket name
+        endpoint_url : str, optional
+            URL of an S3 compatible service to use instead of AWS, e.g. a local S3 stand-in for tests
+        max_workers : int
+            Number of files transferred at the same time
+        transfer_config : TransferConfig, optional
+            Settings of the download of each file (multipart threshold, concurrency, ...)
+        upload_transfer_config : TransferConfig, optional
+            Settings of the upload of each file. By default, large statement PDFs are uploaded in
+            parts of 16 MB, 4 parts at a time
+        backend : StorageBackend, optional
+            Storage of the documents, e.g. a LocalBackend for offline runs. By default, an S3Backend
+            with the previous parameters
         """
         self.aws_access_key = aws_access_key
         self.aws_secret_key = aws_secret_key
         self.bucket_name = bucket_name
-        self.s3_client = boto3.client(
-            "s3",
-            aws_access_key_id=self.aws_access_key,
-            aws_secret_access_key=self.aws_secret_key,
-        )
+        self.endpoint_url = endpoint_url
+        self.max_workers = max_workers
+
+        if backend is None:
+            backend = S3Backend(aws_access_key, aws_secret_key, bucket_name, endpoint_url=endpoint_url,
+                                max_workers=max_workers, transfer_config=transfer_config,
+                                upload_transfer_config=upload_transfer_config)
+        self.backend = backend
+
+        # The boto3 client, when the documents are in S3
+        self.s3_client = getattr(self.backend, "s3_client", None)
+
+        # Errors of the documents that could not be downloaded by the last sync
+        self.errors = {}
 
     def upload_documents_to_s3(self, file_paths):
         """
@@ -38,7 +65,7 @@ class DocumentProcessor:
         for file_path in file_paths:
             object_name = file_path.split("/")[-1]
             if object_name.lower().endswith(".pdf"):
-                self.s3_client.upload_file(file_path, self.bucket_name, object_name)
+                self.backend.put(object_name, file_path)
                 print(
                     f"File '{file_path}' uploaded successfully to S3."
                 )
@@ -47,27 +74,347 @@ class DocumentProcessor:
                     f"The file '{file_path}' is not a PDF file and will not be uploaded to S3."
                 )
 
-    def download_documents_from_s3(self):
+    def upload_documents_to_s3_parallel(self, file_paths, callback=None):
         """
-        Download documents from AWS S3
+        Upload documents to AWS S3, max_workers documents at a time
+
+        With the S3 backend, large documents are uploaded in parts, several parts at a time
+        (see upload_transfer_config).
+        A document that cannot be uploaded does not stop the rest.
+
+        Parameters
+        ----------
+        file_paths : list
+            List of file paths to upload to S3
+        callback : function, optional
+            Called from the upload threads when each document finishes, with the file path and None,
+            or the file path and the exception if it was not uploaded (files that are not PDFs
+            are not uploaded)
+
+        Returns
+        -------
+        dict
+            Number of files and bytes uploaded, elapsed seconds, and throughput in files/s and bytes/s
         """
+        start = time.perf_counter()
 
-        response = self.s3_client.list_objects(Bucket=self.bucket_name)
-        objects = response.get("Contents", [])
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [executor.submit(self.upload_document, file_path, callback) for file_path in file_paths]
+            sizes = [future.result() for future in futures]
 
-        for obj in objects:
-            object_name = obj["Key"]
-            if object_name.lower().endswith(".pdf"):
-                file_path = "../data/"+object_name
+        uploaded = [size for size in sizes if size is not None]
+        return self.get_throughput(len(uploaded), sum(uploaded), time.perf_counter() - start)
 
-                self.s3_client.download_file(
-                    self.bucket_name, object_name, file_path
-                )
+    def upload_document(self, file_path, callback=None):
+        """
+        Upload a document to AWS S3, reporting the result to the callback instead of raising
+
+        Parameters
+        ----------
+        file_path : str
+            Path of the document, it is uploaded with its file name as key
+        callback : function, optional
+            Called with the file path and None, or the file path and the exception
+
+        Returns
+        -------
+        int
+            Size of the uploaded document, or None if it was not uploaded
+        """
+        object_name = os.path.basename(file_path)
+        try:
+            if not object_name.lower().endswith(".pdf"):
+                raise ValueError(f"The file '{file_path}' is not a PDF file and will not be uploaded to S3.")
+
+            size = os.path.getsize(file_path)
+            self.backend.put(object_name, file_path)
+        except Exception as error:
+            if callback is not None:
+                callback(file_path, error)
+            return None
+
+        if callback is not None:
+            callback(file_path, None)
+        return size
+
+    def list_documents(self, prefix=""):
+        """
+        List the PDF documents of the bucket, following the pages of the listing
+
+        Parameters
+        ----------
+        prefix : str
+            Only the keys starting with this prefix are listed
+
+        Returns
+        -------
+        Iterator[dict]
+            The objects of the listing (Key, Size, ETag, LastModified, ...), one at a time
+        """
+        for obj in self.backend.list_documents(prefix):
+            if obj["Key"].lower().endswith(".pdf"):
+                yield obj
+
+    def get_document_stream(self, object_name):
+        """
+        Open a document for reading, without downloading it to a file
+
+        Parameters
+        ----------
+        object_name : str
+            Key of the document
+
+        Returns
+        -------
+        file-like
+            The content of the document (see StorageBackend.get_stream)
+        """
+        return self.backend.get_stream(object_name)
+
+    def download_document(self, object_name, download_path):
+        """
+        Download a document from AWS S3
+
+        Parameters
+        ----------
+        object_name : str
+            Key of the document in the bucket
+        download_path : str
+            Folder where the document is saved, keeping the folders of the key
+
+        Returns
+        -------
+        str
+            Path of the downloaded file
+
+        Raises
+        ------
+        ValueError
+            If the key leads outside the download folder (see get_download_file_path)
+        """
+        file_path = self.get_download_file_path(object_name, download_path)
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        self.backend.download(object_name, file_path)
+        return file_path
+
+    @staticmethod
+    def get_download_file_path(object_name, download_path):
+        """
+        Get the path where a document is downloaded, inside the download folder
+
+        Parameters
+        ----------
+        object_name : str
+            Key of the document in the bucket
+        download_path : str
+            Folder where the document is saved, keeping the folders of the key
+
+        Returns
+        -------
+        str
+            Resolved path of the file
+
+        Raises
+        ------
+        ValueError
+            If the key leads outside the download folder, e.g. with '..' or an absolute path
+        """
+        folder = os.path.realpath(download_path)
+        file_path = os.path.realpath(os.path.join(folder, object_name))
+
+        if file_path == folder or os.path.commonpath([folder, file_path]) != folder:
+            raise ValueError(f"The key '{object_name}' leads outside the download folder and will not be downloaded.")
+        return file_path
+
+    def download_documents_from_s3(self, download_path="../data/", prefix=""):
+        """
+        Download documents from AWS S3, max_workers documents at a time
+
+        Parameters
+        ----------
+        download_path : str
+            Folder where the documents are saved
+        prefix : str
+            Only the documents whose keys start with this prefix are downloaded
+
+        Returns
+        -------
+        dict
+            Number of files and bytes downloaded, elapsed seconds, and throughput in files/s and bytes/s
+        """
+        start = time.perf_counter()
+        files = 0
+        size = 0
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = []
+            for obj in self.list_documents(prefix):
+                futures.append(executor.submit(self.download_document, obj["Key"], download_path))
+                size += obj["Size"]
+
+            # Any error of a download is raised here
+            for future in futures:
+                future.result()
+                files += 1
+
+        return self.get_throughput(files, size, time.perf_counter() - start)
+
+    def sync_documents_from_s3(self, download_path="../data/", manifest_path=None, prefix=""):
+        """
+        Download only the documents that are new or changed since the previous sync
+
+        A manifest with the ETag, size and LastModified of each downloaded key is kept next to the
+        documents, and a document is downloaded again only if one of them changed or its file is missing.
+        A document that cannot be downloaded does not stop the rest, its error is kept in self.errors
+        and it is tried again by the next sync.
+
+        Parameters
+        ----------
+        download_path : str
+            Folder where the documents are saved
+        manifest_path : str, optional
+            Path of the manifest. By default, the file .s3_manifest.json in the download folder
+        prefix : str
+            Only the documents whose keys start with this prefix are synchronized
+
+        Returns
+        -------
+        list
+            Keys of the new or changed documents that were downloaded, in the order of the listing
+        """
+        self.errors = {}
+        if manifest_path is None:
+            manifest_path = os.path.join(download_path, ".s3_manifest.json")
+
+        manifest = self.read_manifest(manifest_path)
+        changed = []
+        listed = set()
+
+        for obj in self.list_documents(prefix):
+            listed.add(obj["Key"])
+            try:
+                downloaded = os.path.exists(self.get_download_file_path(obj["Key"], download_path))
+            except ValueError:
+                # The download of the key fails with the same error
+                downloaded = False
+
+            if manifest.get(obj["Key"]) != self.get_manifest_entry(obj) or not downloaded:
+                changed.append(obj)
+
+        # The documents deleted from the bucket are forgotten, their files are kept
+        manifest = {key: entry for key, entry in manifest.items() if key in listed or not key.startswith(prefix)}
+
+        downloaded = []
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = [(obj, executor.submit(self.download_document, obj["Key"], download_path)) for obj in changed]
+
+            # Every finished download is recorded, so a failed one does not make the others download again
+            try:
+                for obj, future in futures:
+                    try:
+                        future.result()
+                    except Exception as error:
+                        self.errors[obj["Key"]] = f"{type(error).__name__}: {error}"
+                        continue
+
+                    manifest[obj["Key"]] = self.get_manifest_entry(obj)
+                    downloaded.append(obj["Key"])
+            finally:
+                self.write_manifest(manifest, manifest_path)
+
+        return downloaded
+
+    @staticmethod
+    def get_manifest_entry(obj):
+        """
+        Get the manifest entry of an object of the listing
+
+        Parameters
+        ----------
+        obj : dict
+            Object of the listing
+
+        Returns
+        -------
+        dict
+            ETag, size and LastModified (ISO format) of the object
+        """
+        return {
+            "etag": obj["ETag"],
+            "size": obj["Size"],
+            "last_modified": obj["LastModified"].isoformat(),
+        }
+
+    @staticmethod
+    def read_manifest(manifest_path):
+        """
+        Read a sync manifest
+
+        Parameters
+        ----------
+        manifest_path : str
+            Path of the manifest
+
+        Returns
+        -------
+        dict
+            Manifest entry of each key, empty if the manifest does not exist
+        """
+        if not os.path.exists(manifest_path):
+            return {}
+
+        with open(manifest_path, "r", encoding="utf-8") as file:
+            return json.load(file)
+
+    @staticmethod
+    def write_manifest(manifest, manifest_path):
+        """
+        Write a sync manifest
+
+        Parameters
+        ----------
+        manifest : dict
+            Manifest entry of each key
+        manifest_path : str
+            Path of the manifest
+        """
+        os.makedirs(os.path.dirname(manifest_path) or ".", exist_ok=True)
+
+        # Write to a temporary file first, so a failed write does not corrupt the manifest
+        temporary_path = manifest_path + ".tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump(manifest, file, ensure_ascii=False, indent=1)
+        os.replace(temporary_path, manifest_path)
+
+    @staticmethod
+    def get_throughput(files, size, seconds):
+        """
+        Summarize a transfer
+
+        Parameters
+        ----------
+        files : int
+            Number of files transferred
+        size : int
+            Number of bytes transferred
+        seconds : float
+            Elapsed time of the transfer
+
+        Returns
+        -------
+        dict
+            Number of files and bytes, elapsed seconds, and throughput in files/s and bytes/s
+        """
+        return {
+            "files": files,
+            "bytes": size,
+            "seconds": seconds,
+            "files_per_second": files / seconds if seconds > 0 else 0.0,
+            "bytes_per_second": size / seconds if seconds > 0 else 0.0,
+        }
 
-                print(f"File '{object_name}' downloaded successfully from S3.")
 
-                
-                
 
 if __name__ == "__main__":
     # AWS credentials
@@ -93,6 +440,15 @@ if __name__ == "__main__":
     file_paths = ["CONS Test File.pdf", "FIDU Test File.pdf"]
     document_processor.upload_documents_to_s3(file_paths)
 
+    # Upload documents to S3 in parallel, collecting the errors in the callback
+    errors = {}
+    throughput = document_processor.upload_documents_to_s3_parallel(
+        file_paths, callback=lambda file_path, error: error is not None and errors.update({file_path: error}))
+    print(f"Uploaded {throughput['files']} files at {throughput['files_per_second']:.1f} files/s "
+          f"and {throughput['bytes_per_second'] / 1e6:.1f} MB/s, errors: {errors}")
+
     # Download documents from S3
-    document_processor.download_documents_from_s3()
+    throughput = document_processor.download_documents_from_s3()
+    print(f"Downloaded {throughput['files']} files at {throughput['files_per_second']:.1f} files/s "
+          f"and {throughput['bytes_per_second'] / 1e6:.1f} MB/s")
 